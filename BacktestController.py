@@ -5,9 +5,14 @@ import datetime
 import pprint
 import queue
 import time
+from collections import Counter
+from functools import cached_property
 
+from Calendar import RebalanceCalendar
 from PerformanceDT import Performance
 from EventBuilder import MarketEvent
+from Instrumentation import ProgressReporter
+from VectorizedBacktest import VectorizedBacktest
 
 
 class Backtest(object):
@@ -15,7 +20,9 @@ class Backtest(object):
     def __init__(
             self,
             stock_data, symbol_list, order_list,signal_list, initial_capital, heartbeat, start_date,
-            data_handler_cls, execution_handler_cls, portfolio_cls, strategy_cls
+            data_handler_cls, execution_handler_cls, portfolio_cls, strategy_cls, event_queue_cls=queue.Queue,
+            engine='event', commission=None, benchmarks=None, profiler=None, progress_interval=5.0,
+            schedule=None, batch_signals=False, cash_feasible=False, lazy_universe=False, checkpoint=None
     ):
 
         self.stock_data = stock_data
@@ -32,11 +39,20 @@ class Backtest(object):
         self.portfolio_cls = portfolio_cls
         self.strategy_cls = strategy_cls
 
-        self.events = queue.Queue()
-
-        self.signals = 0
-        self.orders = 0
-        self.fills = 0
+        self.engine = engine  # 'event' or 'vectorized'
+        self.commission = commission  # Overrides the execution and sizing commission rates if set
+        self.benchmarks = benchmarks  # Display name -> benchmark registry name, Performance defaults if None
+        self.profiler = profiler  # Instrumentation.BacktestProfiler, or None to run uninstrumented
+        self.progress_interval = progress_interval  # Seconds between progress lines, None for silence
+        self.schedule = schedule  # None feeds every bar; 'D', 'W', 'M', 'Q' or a list of dates feeds to period ends
+        self.batch_signals = batch_signals  # One target-weight event per rebalance instead of one per symbol
+        self.cash_feasible = cash_feasible  # Scale rebalance buys to the cash sells free up (batch and vectorized)
+        self.lazy_universe = lazy_universe  # Load only the symbols the strategy can trade, the rest on first access
+        self.checkpoint = checkpoint  # Checkpoint.Checkpoint saving the event loop state, or None
+        self.completed_steps = 0  # Event loop steps done before this run, set when resuming
+        self.events = event_queue_cls()
+
+        self.event_counts = Counter()  # Events handled, per event type
         # self.num_strats = 1
 
         self._generate_trading_instances()
@@ -46,13 +62,19 @@ class Backtest(object):
         print(
             "Creating DataHandler, StrategyFactory, Portfolio and Execution Objects/n")
 
-        self.data_handler = self.data_handler_cls(self.events, self.stock_data, self.start_date, self.symbol_list)
+        options = dict(lookback=self.strategy_cls.lookback)
+        if self.lazy_universe:
+            options['required_symbols'] = self.strategy_cls.required_symbols(self.order_list)
+        self.data_handler = self.data_handler_cls(self.events, self.stock_data, self.start_date, self.symbol_list,
+                                                  **options)
 
         self.strategy = self.strategy_cls(self.data_handler, self.events, self.order_list,self.signal_list)
 
         self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date,
                                             self.initial_capital)
         self.execution_handler = self.execution_handler_cls(self.events)
+        self._apply_options()
+        self._register_handlers()
 
     def _reset_classes(self):
         self.strategy = self.strategy_cls(self.data_handler, self.events, self.order_list,self.signal_list)
@@ -60,22 +82,77 @@ class Backtest(object):
         self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date,
                                             self.initial_capital)
         self.execution_handler = self.execution_handler_cls(self.events)
+        self._apply_options()
+        self._register_handlers()
+
+    def _apply_options(self):
+        """
+        Push run options down to the components built from the classes.
+        """
+        self.strategy.batch_signals = self.batch_signals
+        self.portfolio.cash_feasible = self.cash_feasible
+        self.execution_handler.universe = self.data_handler.universe
+        if self.commission is not None:
+            self.execution_handler.commission = self.commission
+        self.portfolio.commission = self.execution_handler.commission  # Size orders with the rate they fill at
+
+    def _register_handlers(self):
+        """
+        Dispatch table from event type to the handler that consumes it.
+        """
+        self.handlers = {
+            'MARKET': self.strategy.calculate_signals,
+            'SIGNAL': self.portfolio.process_signal,  # generate_smart_order
+            'ORDER': self.execution_handler.execute_order,
+            'FILL': self.portfolio.process_fill,
+            'TARGET': self.portfolio.process_target,
+            'BATCH_ORDER': self.execution_handler.execute_batch_order,
+            'BATCH_FILL': self.portfolio.process_batch_fill,
+        }
+
+    # Batch events count once each, however many symbols they carry
+    @property
+    def signals(self):
+        return self.event_counts['SIGNAL'] + self.event_counts['TARGET']
+
+    @property
+    def orders(self):
+        return self.event_counts['ORDER'] + self.event_counts['BATCH_ORDER']
+
+    @property
+    def fills(self):
+        return self.event_counts['FILL'] + self.event_counts['BATCH_FILL']
 
     def _run_backtest(self):
 
-        i = 0
+        handlers = self.handlers
+        event_counts = self.event_counts
+        calendar = None
+        total = self.data_handler.get_bar_count()
+        if self.schedule is not None:
+            calendar = RebalanceCalendar(self.data_handler.dates, self.schedule)
+            total = int((calendar.boundaries >= self.data_handler.bar_index).sum())
+        progress = None
+        if self.progress_interval is not None:
+            progress = ProgressReporter(self.progress_interval, total)
+        checkpoint = self.checkpoint
+        i = self.completed_steps
         while True:  # The outer while loop is to control the feed of data
             i += 1
-            print(i)
+            if progress is not None:
+                progress.update(i)
+            if checkpoint is not None:
+                checkpoint.step(self, i)
 
-            if self.data_handler.continue_backtest:
-                # self.data_handler.update_bars_monthly() # Feed data in a monthly space, create a market event at the end of each month.
+            if not self.data_handler.continue_backtest:
+                break
+            elif calendar is None:
                 self.data_handler.update_bars()  # Feed data at the frequency of raw data.
                 # self.strategy.calculate_stopping()  # Stopping loss
                 self.portfolio.update_timeindex()  # Update all position and equity recordings
-
             else:
-                break
+                self.data_handler.update_bars_batch(calendar)  # Feed data up to the next period end, one market event
+                self.portfolio.update_timeindex_batch()
 
             while True:  # The inner while loop is to control the event queue
                 try:
@@ -84,26 +161,64 @@ class Backtest(object):
                     break
                 else:
                     if event is not None:
-                        if event.type == 'MARKET':
-                            self.strategy.calculate_signals(event)
-
-                        elif event.type == 'SIGNAL':
-                            self.signals += 1
-                            self.portfolio.process_signal(event)  # generate_smart_order
-                        elif event.type == 'ORDER':
-                            self.orders += 1
-                            self.execution_handler.execute_order(event)
-                        elif event.type == 'FILL':
-                            self.fills += 1
-                            self.portfolio.process_fill(event)
+                        event_counts[event.type] += 1
+                        handlers[event.type](event)
 
                 if self.events.empty() and self.strategy.reading_orders == False:  # If events are all processed and a sold process finished
                     self.events.put(MarketEvent())
 
             time.sleep(self.heartbeat)
 
+    def _run_vectorized(self):
+        engine = VectorizedBacktest(self.data_handler, self.strategy, self.portfolio, self.execution_handler)
+        self.event_counts.update(engine.run())
+
+    def _check_schedule(self):
+        """
+        A schedule is laid over the full date index of the data handler.
+        """
+        if not hasattr(self.data_handler, 'dates'):
+            raise ValueError("schedule needs a data handler with a full date index (Columnar, Memmap or "
+                             "Historic), not %s" % type(self.data_handler).__name__)
+
+    def _check_vectorized(self):
+        """
+        The vectorized engine reads whole bar matrices and Smartbeta-style dated targets.
+        """
+        bars = self.data_handler
+        if not (hasattr(bars, 'bar_data') or hasattr(bars, 'get_value_matrix')):
+            raise ValueError("engine='vectorized' needs a data handler holding the full bar matrix "
+                             "(Columnar, Memmap or Historic), not %s" % type(bars).__name__)
+        if not (hasattr(self.strategy, 'rms_signals') and hasattr(self.strategy, 'rebalance_index')):
+            raise ValueError("engine='vectorized' needs a strategy with rms_signals and rebalance_index "
+                             "like Smartbeta, not %s" % type(self.strategy).__name__)
+
+    def run_engine(self):
+        if self.engine == 'vectorized':
+            self._check_vectorized()
+            self._run_vectorized()
+        else:
+            if self.schedule is not None:
+                self._check_schedule()
+            if self.profiler is not None:
+                self.profiler.instrument(self)
+            try:
+                self._run_backtest()
+            finally:
+                if self.checkpoint is not None:
+                    self.checkpoint.close()  # Let the last checkpoint reach the disk
+            if self.profiler is not None:
+                self.profiler.finish()
+
+    @cached_property
+    def performance(self):
+        """
+        Performance of the finished run, shared by every output; run_trading() rebuilds it after each run.
+        """
+        return Performance(self.portfolio, self.benchmarks)
+
     def _output_performance(self):
-        performance_inst = Performance(self.portfolio)
+        performance_inst = self.performance
 
         print("Creating summary stats...")
         metrics = performance_inst.calculate_metrics()
@@ -121,7 +236,17 @@ class Backtest(object):
 
     def run_trading(self):
 
-        self._run_backtest()
+        self.run_engine()
+        self.performance = Performance(self.portfolio, self.benchmarks)
         self._output_performance()
-        curve_plot = Performance(self.portfolio)
-        curve_plot.curve_plot()
+        self.performance.curve_plot()
+
+    def resume_trading(self):
+        """
+        Continue from the latest checkpoint, or start from the first bar if there is none, and
+        produce the same outputs as an uninterrupted run. The Backtest needs a checkpoint to read from.
+        """
+        if self.checkpoint is None:
+            raise ValueError("resume_trading() needs Backtest(checkpoint=Checkpoint(path)) to resume from")
+        self.completed_steps = self.checkpoint.restore(self)
+        self.run_trading()
@@ -0,0 +1,54 @@
+# Calendar.py
+# This file precomputes rebalance period boundaries over the shared date index of a data handler.
+
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = {
+    'D': None,
+    'W': lambda d: d.isocalendar().year.values * 100 + d.isocalendar().week.values,  # ISO year, weeks span New Year
+    'M': lambda d: d.year * 100 + d.month,
+    'Q': lambda d: d.year * 10 + d.quarter,
+}
+
+
+class RebalanceCalendar(object):
+    """
+    Positions in dates of the last bar of every period, computed once. frequency is 'D', 'W',
+    'M' or 'Q', or a list of dates: a custom date ends a period on the last bar on or before it.
+    The last bar always ends a period, so a partial final period is still fed.
+    """
+
+    def __init__(self, dates, frequency='M'):
+        self.dates = np.asarray(dates)
+        self.frequency = frequency
+        n = len(self.dates)
+
+        if isinstance(frequency, str):
+            if frequency not in FREQUENCIES:
+                raise ValueError("Unknown rebalance frequency %r, expected one of %s" % (frequency, list(FREQUENCIES)))
+            if FREQUENCIES[frequency] is None:
+                ends = np.arange(n)
+            else:
+                period = np.asarray(FREQUENCIES[frequency](pd.DatetimeIndex(pd.to_datetime(self.dates))))
+                ends = np.flatnonzero(period[1:] != period[:-1])
+        else:
+            custom = np.sort(np.asarray(list(frequency), dtype=self.dates.dtype))
+            ends = np.searchsorted(self.dates, custom, side='right') - 1
+            ends = ends[ends >= 0]
+
+        self.boundaries = np.unique(np.append(ends, n - 1)).astype(np.int64) if n else np.zeros(0, dtype=np.int64)
+
+    def next_boundary(self, t):
+        """
+        Position of the first period end at or after position t.
+        """
+        k = int(np.searchsorted(self.boundaries, t))
+        return int(self.boundaries[min(k, len(self.boundaries) - 1)])
+
+    def is_boundary(self, t):
+        k = int(np.searchsorted(self.boundaries, t))
+        return k < len(self.boundaries) and self.boundaries[k] == t
+
+    def __len__(self):
+        return len(self.boundaries)
@@ -0,0 +1,177 @@
+# Checkpoint.py
+# This file saves the state of a running backtest at intervals and restores it, so an interrupted run
+# resumes from its last checkpoint instead of from the first bar.
+
+import os
+import pickle
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+STATE_FILE = 'state.pkl'
+
+
+def _append_chunk(path, values, truncate):
+    """
+    Append values to a column file as one .npy chunk, or start the file with it.
+    """
+    with open(path, 'wb' if truncate else 'ab') as f:
+        np.save(f, values, allow_pickle=True)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_column(path, n):
+    """
+    The first n rows of a column file. Chunks appended after them, by a checkpoint whose state was
+    never written, are cut off the file.
+    """
+    chunks = []
+    rows = 0
+    with open(path, 'r+b') as f:
+        while rows < n:
+            chunks.append(np.load(f, allow_pickle=True))
+            rows += len(chunks[-1])
+        f.truncate(f.tell())
+    if rows != n:
+        raise ValueError("%s holds %d rows, the checkpoint expects %d" % (path, rows, n))
+    return np.concatenate(chunks)
+
+
+def _pending_events(events):
+    """
+    The events waiting in a queue, left in place.
+    """
+    pending = []
+    while True:
+        try:
+            pending.append(events.get(False))
+        except queue.Empty:
+            break
+    for event in pending:
+        events.put(event)
+    return pending
+
+
+class Checkpoint(object):
+    """
+    Checkpoints of a Backtest in directory path, taken every `every` steps of the event loop.
+    Positions, holdings and execution records are append-only, so a checkpoint appends only the rows
+    recorded since the previous one, one file per column. The rest of the state (data cursors, current
+    positions and holdings, strategy flags, pending events and counters) is small; it is pickled whole
+    and replaces state.pkl once the rows it counts are on disk. The loop only copies what changed,
+    the files are written on a background thread.
+    """
+
+    def __init__(self, path='checkpoint', every=250):
+        self.path = path
+        self.every = every
+        self.iteration = 0  # Loop step of the latest checkpoint
+        self.rows = {}  # Table -> rows on disk
+        self.writer = None
+        self.pending = None
+
+    @staticmethod
+    def _tables(backtest):
+        """
+        Append-only tables of the backtest, each with history_columns() and load_history().
+        """
+        tables = {'portfolio': backtest.portfolio}
+        journal = getattr(backtest.execution_handler, 'journal', None)
+        if journal is not None:
+            tables['journal'] = journal
+        return tables
+
+    def _column_path(self, table, name):
+        return os.path.join(self.path, '%s.%s.npy' % (table, name))
+
+    def step(self, backtest, iteration):
+        """
+        Called by the event loop before each step; saves a checkpoint every `every` steps.
+        """
+        if iteration % self.every == 0 and iteration > self.iteration:
+            self.save(backtest, iteration)
+
+    def save(self, backtest, iteration):
+        appends = []
+        rows = {}
+        for table, history in self._tables(backtest).items():
+            written = self.rows.get(table, 0)
+            for name, values in history.history_columns().items():
+                appends.append((self._column_path(table, name), values[written:].copy(), written == 0))
+                rows[table] = len(values)
+
+        state = pickle.dumps({
+            'symbols': len(backtest.symbol_list),
+            'iteration': iteration,
+            'rows': rows,
+            'data_handler': backtest.data_handler.get_state(),
+            'strategy': backtest.strategy.get_state(),
+            'portfolio': backtest.portfolio.get_state(),
+            'event_counts': dict(backtest.event_counts),
+            'events': _pending_events(backtest.events),
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.wait()  # At most one checkpoint in flight
+        if self.writer is None:
+            self.writer = ThreadPoolExecutor(max_workers=1)
+        self.pending = self.writer.submit(self._write, appends, state)
+        self.iteration = iteration
+        self.rows = rows
+
+    def _write(self, appends, state):
+        os.makedirs(self.path, exist_ok=True)
+        for path, values, truncate in appends:
+            _append_chunk(path, values, truncate)
+        tmp = os.path.join(self.path, STATE_FILE + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, STATE_FILE))
+
+    def wait(self):
+        """
+        Block until the checkpoint being written is on disk, raising any error from writing it.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        if self.writer is not None:
+            self.writer.shutdown()
+            self.writer = None
+
+    def restore(self, backtest):
+        """
+        Load the latest checkpoint into a Backtest built with the same arguments. Returns the number
+        of loop steps it had completed, 0 if there is no checkpoint.
+        """
+        path = os.path.join(self.path, STATE_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state['symbols'] != len(backtest.symbol_list):
+            raise ValueError("The checkpoint in %s was saved for %d symbols, not %d"
+                             % (self.path, state['symbols'], len(backtest.symbol_list)))
+
+        for table, history in self._tables(backtest).items():
+            n = state['rows'].get(table, 0)
+            if n:
+                history.load_history(dict((name, _read_column(self._column_path(table, name), n))
+                                          for name in history.history_columns()))
+        backtest.data_handler.set_state(state['data_handler'])
+        backtest.strategy.set_state(state['strategy'])
+        backtest.portfolio.set_state(state['portfolio'])
+        backtest.event_counts.clear()
+        backtest.event_counts.update(state['event_counts'])
+        for event in state['events']:
+            backtest.events.put(event)
+
+        self.iteration = state['iteration']
+        self.rows = state['rows']
+        return state['iteration'] - 1
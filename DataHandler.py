@@ -1,10 +1,20 @@
 # DataHandler.py
 # This file processes raw data to satisfy the requirement of other steps.
-import datetime
+import hashlib
+import itertools
+import json
+import os
+import shutil
 from abc import ABCMeta, abstractmethod
+from collections import deque
+
 import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
 
+from Calendar import RebalanceCalendar
 from EventBuilder import MarketEvent
+from Universe import Universe, date_ordinal, date_ordinals
 
 
 class DataHandler(object):
@@ -37,43 +47,108 @@ class DataHandler(object):
         """
         raise NotImplementedError("Should implement update_bars()")
 
+    def get_latest_cross_section(self, val_type="close"):
+        """
+        Return the latest value of every symbol in symbol_list as one array.
+        """
+        return np.array([self.get_latest_bar_value(s, val_type) for s in self.symbol_list])
+
+    def get_latest_bar_ordinal(self):
+        """
+        Day ordinal (days since 1970-01-01) of the latest bar.
+        """
+        return date_ordinal(self.get_latest_bar_datetime(self.symbol_list[0]))
+
+    def get_latest_value_by_id(self, symbol_id, val_type="close"):
+        """
+        get_latest_bar_value for an interned symbol id.
+        """
+        return self.get_latest_bar_value(self.symbol_list[symbol_id], val_type)
+
+    def update_bars_batch(self, calendar):
+        """
+        Feed every bar up to the next period end of a RebalanceCalendar and create one market event.
+        """
+        raise NotImplementedError("Should implement update_bars_batch()")
+
+    def get_latest_block(self, val_type="close"):
+        """
+        Datetimes and (time x symbol) values of the bars fed by the last update_bars_batch().
+        """
+        raise NotImplementedError("Should implement get_latest_block()")
+
+    def get_bar_count(self):
+        """
+        Number of bars the handler will feed, or None if unknown.
+        """
+        return None
+
+    def get_state(self):
+        """
+        Picklable feed position, restored by set_state() on a handler built with the same arguments.
+        """
+        raise NotImplementedError("Should implement get_state()")
+
+    def set_state(self, state):
+        raise NotImplementedError("Should implement set_state()")
+
 
 class HistoricDataHandler(DataHandler):
-    def __init__(self, events, stock_data, start_date, symbol_list):
+    """
+    Feed bars from per-symbol DataFrames. With required_symbols set, only those symbols are
+    converted up front; any other symbol in symbol_list is converted on first access (or through
+    register_symbols) and caught up to the current bar. Until then it reads as 0 in cross sections,
+    as a symbol does before its first bar. The other handlers accept required_symbols and ignore it.
+    """
+
+    def __init__(self, events, stock_data, start_date, symbol_list, lookback=None, required_symbols=None):
 
         self.events = events
         self.stock_data = stock_data
-        self.start_month = start_date.month
         self.start_date = start_date.strftime("%Y-%m-%d")
         self.symbol_list = symbol_list
+        self.universe = Universe(symbol_list)
+        self.lookback = lookback  # Keep only the latest N bars per symbol if set
 
         self.symbol_data = {}
         self.latest_symbol_data = {}
         self.beginning_price = {}
         self.continue_backtest = True
-        self.bar_index = 0
+        self.bar_index = 0  # Bars fed
+        self.batch_start = 0
         self.data_generator = {}
-        self.next_month_bar = {}
-        self.latest_data_month = start_date.month
+        self.monthly_calendar = None
+        self.loaded_symbols = []  # Symbols converted so far, the only ones fed
+        self.comb_index = None
+        self.symbol_rows = None
 
-        self._open_and_convert_datafile()
+        if required_symbols is None:
+            self._open_and_convert_datafile()
+        else:
+            required = set(required_symbols)
+            # The first symbol is always loaded, it dates the bars
+            self._open_and_convert_datafile([s for i, s in enumerate(symbol_list) if i == 0 or s in required])
+        self.dates = self.symbol_data[self.loaded_symbols[0]].index.values
+        self.date_ordinals = date_ordinals(self.dates)
 
     def _open_and_convert_datafile(self, symbol_list=None):
 
         if symbol_list is None:
             symbol_list = self.symbol_list
 
-        comb_index = self.stock_data.set_index('datetime').index.unique()
+        if self.comb_index is None:
+            self.comb_index = self.stock_data.set_index('datetime').index.unique()
+            self.symbol_rows = self.stock_data.groupby('symbol').indices  # Symbol -> row positions
+        comb_index = self.comb_index
 
         # Split dataframes for each stock
         for s in symbol_list:
-            df_stock = self.stock_data[self.stock_data.symbol.isin([s])]
+            df_stock = self.stock_data.iloc[self.symbol_rows.get(s, [])]
             self.symbol_data[s] = df_stock.set_index('datetime').sort_index()
 
         for s in symbol_list:
             # Initialization
-            self.latest_symbol_data[s] = []
-            self.next_month_bar[s] = []
+            self.latest_symbol_data[s] = self._new_latest_bars()
             if len(self.symbol_data[s]) < len(comb_index):
                 self.symbol_data[s] = self.symbol_data[s].reindex(index=comb_index, method='pad')
             self.symbol_data[s] = self.symbol_data[s].fillna(0)
@@ -81,14 +156,59 @@ class HistoricDataHandler(DataHandler):
             self.symbol_data[s]["Pct_change"] = self.symbol_data[s].close.pct_change()
             self.symbol_data[s] = self.symbol_data[s].loc[self.start_date:]
             self.data_generator[s] = self.symbol_data[s].iterrows() # Create a generator
+            if self.bar_index:  # Loaded mid-run, catch up with the bars already fed
+                self.latest_symbol_data[s].extend(itertools.islice(self.data_generator[s], self.bar_index))
+            self.loaded_symbols.append(s)
+
+    def register_symbols(self, symbols):
+        """
+        Load symbols now rather than on first access.
+        """
+        self._open_and_convert_datafile([s for s in symbols if s not in self.symbol_data])
+
+    def _latest_bars(self, symbol):
+        if symbol not in self.latest_symbol_data and symbol in self.universe.ids:
+            self._open_and_convert_datafile([symbol])  # Load on first access
+        return self.latest_symbol_data[symbol]
+
+    def get_state(self):
+        return {'bar_index': self.bar_index, 'batch_start': self.batch_start,
+                'continue_backtest': self.continue_backtest, 'loaded_symbols': list(self.loaded_symbols),
+                'beginning_price': dict(self.beginning_price)}
+
+    def set_state(self, state):
+        """
+        Rebuild the generators and latest bars of the loaded symbols at the saved bar.
+        """
+        self.bar_index = 0
+        self.register_symbols(state['loaded_symbols'])
+        self._reset_latest_data()
+        for s in self.loaded_symbols:
+            self.latest_symbol_data[s].extend(itertools.islice(self.data_generator[s], state['bar_index']))
+        self.bar_index = state['bar_index']
+        self.batch_start = state['batch_start']
+        self.continue_backtest = state['continue_backtest']
+        self.beginning_price = state['beginning_price']
 
     def _reset_latest_data(self, symbol_list=None):
         if symbol_list is None:
-            symbol_list = self.symbol_list
+            symbol_list = self.loaded_symbols
         for s in symbol_list:
             self.data_generator[s] = self.symbol_data[s].iterrows()
-            self.latest_symbol_data[s] = []
-            self.next_month_bar[s] = []
+            self.latest_symbol_data[s] = self._new_latest_bars()
+        self.bar_index = 0
+        self.continue_backtest = True
+
+    def _new_latest_bars(self):
+        """
+        A ring buffer of the latest lookback bars, or an unbounded list if no lookback is set.
+        """
+        if self.lookback is None:
+            return []
+        return deque(maxlen=self.lookback)
+
+    def get_bar_count(self):
+        return len(self.dates)
 
     def _get_new_bar(self, symbol):
         """
@@ -103,7 +223,7 @@ class HistoricDataHandler(DataHandler):
         """
 
         try:
-            bars_list = self.latest_symbol_data[symbol]
+            bars_list = self._latest_bars(symbol)
         except KeyError:
             print("That symbol is not available in the historical data set.")
             raise
@@ -116,12 +236,14 @@ class HistoricDataHandler(DataHandler):
         """
 
         try:
-            bars_list = self.latest_symbol_data[symbol]
+            bars_list = self._latest_bars(symbol)
         except KeyError:
             print("That symbol is not available in the historical data")
             raise
         else:
-            return bars_list[-N:]
+            if self.lookback is None:
+                return bars_list[-N:]
+            return list(itertools.islice(bars_list, max(len(bars_list) - N, 0), None))
 
     def get_latest_bar_datetime(self, symbol):
         """
@@ -129,7 +251,7 @@ class HistoricDataHandler(DataHandler):
         """
 
         try:
-            bars_list = self.latest_symbol_data[symbol]
+            bars_list = self._latest_bars(symbol)
         except KeyError:
             print("That symbol is not available in the historical data")
             raise
@@ -138,7 +260,7 @@ class HistoricDataHandler(DataHandler):
 
     def get_latest_bar_value(self, symbol, val_type="close"):
         try:
-            bars_list = self.latest_symbol_data[symbol]
+            bars_list = self._latest_bars(symbol)
         except KeyError:
             print("That Symbol is not available in the historical data")
             raise
@@ -159,7 +281,7 @@ class HistoricDataHandler(DataHandler):
         Update bars into latest_symbol_data.
         """
 
-        for s in self.symbol_list:
+        for s in self.loaded_symbols:
             try:
                 bar = next(self._get_new_bar(s))
             except StopIteration:
@@ -167,37 +289,537 @@ class HistoricDataHandler(DataHandler):
             else:
                 if bar is not None:
                     self.latest_symbol_data[s].append(bar)
+        if self.continue_backtest:
+            self.bar_index += 1
 
         self.events.put(MarketEvent())
 
+    def get_latest_cross_section(self, val_type="close"):
+        """
+        Latest value of every symbol in symbol_list, 0 for symbols not loaded yet.
+        """
+        values = np.zeros(len(self.symbol_list))
+        for s in self.loaded_symbols:
+            bars_list = self.latest_symbol_data[s]
+            if bars_list:
+                values[self.universe.ids[s]] = getattr(bars_list[-1][1], val_type)
+        return values
+
+    def update_bars_batch(self, calendar):
+        """
+        Update bars into latest_symbol_data up to the next period end of calendar.
+        """
+        if self.bar_index < len(self.dates):
+            end = calendar.next_boundary(self.bar_index) + 1
+            for s in self.loaded_symbols:
+                self.latest_symbol_data[s].extend(itertools.islice(self.data_generator[s], end - self.bar_index))
+            self.batch_start, self.bar_index = self.bar_index, end
+        else:
+            self.batch_start = max(self.bar_index - 1, 0)
+            self.continue_backtest = False
+
+        self.events.put(MarketEvent())
+
+    def get_value_matrix(self, val_type="close", start=0, stop=None):
+        """
+        (time x symbol) values of the bars from start to stop, 0 for symbols not loaded yet.
+        """
+        stop = len(self.dates) if stop is None else stop
+        values = np.zeros((stop - start, len(self.symbol_list)))
+        for s in self.loaded_symbols:
+            values[:, self.universe.ids[s]] = self.symbol_data[s][val_type].values[start:stop]
+        return values
+
+    def get_latest_block(self, val_type="close"):
+        return self.dates[self.batch_start:self.bar_index], self.get_value_matrix(val_type, self.batch_start, self.bar_index)
+
     def update_bars_monthly(self):
         """
-            Update bars into latest_symbol_data monthly.
+            Update bars into latest_symbol_data up to the end of the month, create a market event.
+        """
+        if self.monthly_calendar is None:
+            self.monthly_calendar = RebalanceCalendar(self.dates, 'M')
+        first = self.bar_index
+        self.update_bars_batch(self.monthly_calendar)
+        if first < len(self.dates):
+            for s in self.loaded_symbols:
+                self.beginning_price[s] = self.symbol_data[s].close.values[first]  # First bar of the month
+
+
+def build_bar_matrices(stock_data, symbol_list):
+    """
+    Align stock_data into one (symbol x datetime) float64 matrix per field.
+    Rows missing for a symbol carry its previous bar forward and leading gaps are 0,
+    the same as the reindex/pad/fillna steps of HistoricDataHandler.
+    """
+    dates = np.sort(stock_data.datetime.unique())
+    stock_data = stock_data[stock_data.symbol.isin(symbol_list)]
+    fields = [c for c in stock_data.columns if c not in ('datetime', 'symbol') and is_numeric_dtype(stock_data[c])]
+
+    rows = pd.Index(symbol_list).get_indexer(stock_data.symbol)
+    cols = np.searchsorted(dates, stock_data.datetime.values)
+
+    # Index of the last bar each symbol actually traded on, -1 before its first bar
+    last_bar = np.full((len(symbol_list), len(dates)), -1, dtype=np.int64)
+    last_bar[rows, cols] = cols
+    np.maximum.accumulate(last_bar, axis=1, out=last_bar)
+    missing = last_bar < 0
+    np.maximum(last_bar, 0, out=last_bar)
+
+    bar_data = {}
+    for f in fields:
+        raw = np.full(last_bar.shape, np.nan)
+        raw[rows, cols] = stock_data[f].values
+        matrix = np.take_along_axis(raw, last_bar, axis=1)
+        matrix[missing | np.isnan(matrix)] = 0.0
+        bar_data[f] = matrix
+
+    close = bar_data['close']
+    pct_change = np.full(close.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change[:, 1:] = close[:, 1:] / close[:, :-1] - 1
+    bar_data['Pct_change'] = pct_change
+
+    return dates, bar_data
+
+
+def write_bar_store(stock_data, path, symbol_list=None, start_date=None):
+    """
+    Write the aligned bar matrices to path as one raw .npy file per field plus a manifest.json
+    of symbols, dates and fields. Bars before start_date are dropped after Pct_change is computed.
+    """
+    if symbol_list is None:
+        symbol_list = stock_data.symbol.unique()
+    dates, bar_data = build_bar_matrices(stock_data, symbol_list)
+    start = 0 if start_date is None else int(np.searchsorted(dates, start_date.strftime("%Y-%m-%d")))
+
+    os.makedirs(path, exist_ok=True)
+    for field, matrix in bar_data.items():
+        np.save(os.path.join(path, field + '.npy'), np.ascontiguousarray(matrix[:, start:]))
+    manifest = {'symbols': list(symbol_list), 'dates': list(dates[start:]), 'fields': list(bar_data)}
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+
+def refresh_bar_store(source, path):
+    """
+    Build the bar store at path from the price pickle at source, unless a complete store newer than
+    the pickle is already there. The store is written to a temporary directory and moved into place,
+    so an interrupted build never leaves a partial store behind.
+    """
+    manifest = os.path.join(path, 'manifest.json')
+    if os.path.exists(manifest) and os.path.getmtime(manifest) >= os.path.getmtime(source):
+        return path
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        write_bar_store(pd.read_pickle(source), tmp)
+        shutil.rmtree(path, ignore_errors=True)  # An outdated or partial store
+        os.replace(tmp, path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def open_bar_store(path):
+    """
+    Open a bar store written by write_bar_store. Returns (symbols, dates, bar_data) with every
+    field memory-mapped read-only, so pages are only read when touched.
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    bar_data = dict((field, np.load(os.path.join(path, field + '.npy'), mmap_mode='r'))
+                    for field in manifest['fields'])
+    return np.array(manifest['symbols'], dtype=object), np.array(manifest['dates'], dtype=object), bar_data
+
+
+class BarCache(object):
+    """
+    Bar stores on disk keyed by a hash of the input data, symbol list and start date. Entries
+    not used for the longest time are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path='.bar_cache', max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(stock_data, symbol_list, start_date):
+        digest = hashlib.sha1()
+        digest.update(pd.util.hash_pandas_object(stock_data, index=False).values.tobytes())
+        digest.update('\n'.join(map(str, stock_data.columns)).encode())
+        digest.update('\n'.join(map(str, symbol_list)).encode())
+        digest.update(start_date.strftime("%Y-%m-%d").encode())
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    @staticmethod
+    def _size(entry):
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def load(self, stock_data, symbol_list, start_date):
+        """
+        Return (dates, bar_data) for the inputs, preprocessing and storing them on a miss.
+        """
+        key = self.key(stock_data, symbol_list, start_date)
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            os.utime(os.path.join(entry, 'manifest.json'))  # Mark as recently used
+        else:
+            tmp = '%s.%d.tmp' % (entry, os.getpid())
+            write_bar_store(stock_data, tmp, symbol_list, start_date)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not os.path.isdir(entry):  # Only a lost race if another process stored the key first
+                    raise
+            self._evict(keep=key)
+        _, dates, bar_data = open_bar_store(entry)
+        return dates, bar_data
+
+    def _evict(self, keep):
+        entries = []
+        for key in os.listdir(self.path):
+            if key.endswith('.tmp'):  # Still being written by some process
+                continue
+            entry = self._entry(key)
+            manifest = os.path.join(entry, 'manifest.json')
+            if os.path.isdir(entry) and os.path.exists(manifest):
+                entries.append((os.path.getmtime(manifest), key, self._size(entry)))
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(self._entry(key), ignore_errors=True)
+                total -= size
+
+
+class ColumnarDataHandler(DataHandler):
+    """
+    Keep every field as an aligned (symbol x datetime) float64 matrix and feed bars by
+    moving an integer cursor, so no per-bar objects are created. With a lookback set, the
+    latest bars are a window of at most lookback bars over the matrices.
+    """
+
+    def __init__(self, events, stock_data, start_date, symbol_list, lookback=None, bar_arrays=None, cache=None,
+                 required_symbols=None):
+        # required_symbols is accepted for Backtest(lazy_universe=True) and ignored: all symbols are held as matrices
+
+        self.events = events
+        self.start_date = start_date.strftime("%Y-%m-%d")
+        self.symbol_list = symbol_list
+        self.lookback = lookback
+        self.continue_backtest = True
+
+        # bar_arrays is a (dates, bar_data) pair already built for symbol_list, e.g. from shared memory
+        if bar_arrays is None and cache is not None:
+            bar_arrays = cache.load(stock_data, symbol_list, start_date)
+        elif bar_arrays is None:
+            bar_arrays = build_bar_matrices(stock_data, symbol_list)
+        self.dates, self.bar_data = bar_arrays
+        self.date_ordinals = date_ordinals(self.dates)
+        self.universe = Universe(symbol_list)
+        self.symbol_index = self.universe.ids
+        self.start_index = int(np.searchsorted(self.dates, self.start_date))
+        self.bar_index = self.start_index  # One past the latest bar fed
+        self.batch_start = self.start_index  # First bar fed by the last update_bars_batch()
+
+    def _window_start(self, N):
+        if self.lookback is not None:
+            N = min(N, self.lookback)
+        return max(self.start_index, self.bar_index - N)
+
+    def _reset_latest_data(self):
+        self.bar_index = self.start_index
+        self.batch_start = self.start_index
+        self.continue_backtest = True
+
+    def get_state(self):
+        return {'bar_index': self.bar_index, 'batch_start': self.batch_start,
+                'continue_backtest': self.continue_backtest}
+
+    def set_state(self, state):
+        self.bar_index = state['bar_index']
+        self.batch_start = state['batch_start']
+        self.continue_backtest = state['continue_backtest']
+
+    def _latest_index(self):
+        if self.bar_index == self.start_index:
+            raise IndexError("No bar has been fed yet")
+        return self.bar_index - 1
+
+    def _get_row(self, symbol):
+        try:
+            return self.symbol_index[symbol]
+        except KeyError:
+            print("That symbol is not available in the historical data set.")
+            raise
+
+    def _make_bar(self, row, t):
+        return self.dates[t], dict((f, m[row, t]) for f, m in self.bar_data.items())
+
+    def get_latest_bar(self, symbol):
+        """
+        Get the latest bar as a (datetime, {field: value}) tuple.
+        """
+        return self._make_bar(self._get_row(symbol), self._latest_index())
+
+    def get_latest_bars(self, symbol, N=1):
+        """
+        Get the latest N bars，if there is no so many bars ,return N-k bars
+        """
+        row = self._get_row(symbol)
+        return [self._make_bar(row, t) for t in range(self._window_start(N), self.bar_index)]
+
+    def get_latest_bar_datetime(self, symbol):
+        self._get_row(symbol)
+        return self.dates[self._latest_index()]
+
+    def get_latest_bar_value(self, symbol, val_type="close"):
+        return self.bar_data[val_type][self._get_row(symbol), self._latest_index()]
+
+    def get_latest_bars_values(self, symbol, val_type="close", N=1):
+        """
+        Return a view (no copy) over the latest N values of one field.
         """
-        prev_month = self.latest_data_month
-        flag = 0
-        for s in self.symbol_list:
+        return self.bar_data[val_type][self._get_row(symbol), self._window_start(N):self.bar_index]
+
+    def get_latest_cross_section(self, val_type="close"):
+        return self.bar_data[val_type][:, self._latest_index()]
 
-            if self.next_month_bar[s]:
-                self.latest_symbol_data[s].append(self.next_month_bar[s]) # Record the first bar of each month
-                self.beginning_price[s] = self.next_month_bar[s][1]['close']
-                self.next_month_bar[s] = []
+    def get_latest_bar_ordinal(self):
+        return int(self.date_ordinals[self._latest_index()])
+
+    def get_latest_value_by_id(self, symbol_id, val_type="close"):
+        return self.bar_data[val_type][symbol_id, self._latest_index()]
+
+    def get_bar_count(self):
+        return len(self.dates) - self.start_index
+
+    def update_bars(self):
+        """
+        Advance the cursor by one bar.
+        """
+        if self.bar_index < len(self.dates):
+            self.bar_index += 1
+        else:
+            self.continue_backtest = False
+
+        self.events.put(MarketEvent())
+
+    def update_bars_batch(self, calendar):
+        """
+        Advance the cursor past the next period end of calendar in one step.
+        """
+        if self.bar_index < len(self.dates):
+            self.batch_start = self.bar_index
+            self.bar_index = calendar.next_boundary(self.bar_index) + 1
+        else:
+            self.batch_start = max(self.bar_index - 1, self.start_index)
+            self.continue_backtest = False
+
+        self.events.put(MarketEvent())
+
+    def get_latest_block(self, val_type="close"):
+        return self.dates[self.batch_start:self.bar_index], self.bar_data[val_type][:, self.batch_start:self.bar_index].T
+
+
+class MemmapDataHandler(ColumnarDataHandler):
+    """
+    ColumnarDataHandler over a bar store on disk (see write_bar_store). stock_data is the store path.
+    Over the full store nothing is read up front; a subset symbol_list copies only its own rows.
+    """
+
+    def __init__(self, events, stock_data, start_date, symbol_list=None, lookback=None, required_symbols=None):
+        symbols, dates, bar_data = open_bar_store(stock_data)
+        if symbol_list is None:
+            symbol_list = symbols
+        elif list(symbol_list) != list(symbols):
+            rows = pd.Index(symbols).get_indexer(symbol_list)
+            if (rows < 0).any():
+                raise KeyError("Symbols not in the bar store: %s" % list(np.asarray(symbol_list)[rows < 0]))
+            start = int(np.searchsorted(dates, start_date.strftime("%Y-%m-%d")))
+            dates = dates[start:]
+            bar_data = dict((f, m[rows, start:]) for f, m in bar_data.items())
+
+        super(MemmapDataHandler, self).__init__(events, None, start_date, symbol_list, lookback=lookback,
+                                                bar_arrays=(dates, bar_data))
+
+
+class StreamingDataHandler(DataHandler):
+    """
+    Feed bars from date-partitioned files (CSV or Parquet, rows of datetime, symbol and fields,
+    sorted by datetime across files in name order). One time slice is read, padded and aligned
+    at a time, and only the latest lookback bars (1 if not set) are kept in a ring buffer, so
+    memory is bounded by one file chunk plus the lookback window. stock_data is the directory.
+    """
+
+    def __init__(self, events, stock_data, start_date, symbol_list, lookback=None, chunksize=100000,
+                 required_symbols=None):
+        # required_symbols is accepted for Backtest(lazy_universe=True) and ignored: every slice is aligned anyway
+
+        self.events = events
+        self.data_dir = stock_data
+        self.start_date = start_date.strftime("%Y-%m-%d")
+        self.symbol_list = symbol_list
+        self.universe = Universe(symbol_list)
+        self.symbol_index = self.universe.ids
+        self.lookback = lookback or 1
+        self.chunksize = chunksize
+        self.continue_backtest = True
+
+        self.fields = None
+        self.buffer = None  # field -> (lookback x symbol) ring buffer
+        self.buffer_dates = np.empty(self.lookback, dtype=object)
+        self.buffer_ordinals = np.zeros(self.lookback, dtype=np.int64)
+        self.bar_index = 0  # Number of bars fed
+        self._stream = self._iter_aligned_bars()
+
+    def _iter_files(self):
+        for name in sorted(os.listdir(self.data_dir)):
+            if name.endswith('.csv') or name.endswith('.parquet'):
+                yield os.path.join(self.data_dir, name)
+
+    def _read_chunks(self):
+        for path in self._iter_files():
+            if path.endswith('.parquet'):
+                yield pd.read_parquet(path)
             else:
-                try:
-                    bar = next(self._get_new_bar(s))
-                except StopIteration:
-                    self.continue_backtest = False
-                else:
-                    if bar is not None:
-                        cur_month = datetime.datetime.strptime(bar[0], "%Y-%m-%d").month
-                        if cur_month != self.latest_data_month:
-                            self.next_month_bar[s] = bar
-                            flag = 1
-
-                        elif cur_month == self.latest_data_month:
-                            self.latest_symbol_data[s].append(bar)
-                        prev_month = cur_month
-
-        self.latest_data_month = prev_month
-        if flag == 1:
-            self.events.put(MarketEvent())
+                for chunk in pd.read_csv(path, chunksize=self.chunksize):
+                    yield chunk
+
+    def _iter_chunks(self):
+        """
+        Non-empty chunks, with datetimes as "%Y-%m-%d" strings whatever type the file stores them as.
+        """
+        for chunk in self._read_chunks():
+            if not len(chunk):
+                continue
+            if is_datetime64_any_dtype(chunk.datetime):
+                chunk = chunk.assign(datetime=chunk.datetime.dt.strftime("%Y-%m-%d"))
+            yield chunk
+
+    def _iter_slices(self):
+        """
+        Yield (datetime, rows) once all rows of a datetime have been read.
+        """
+        pending = None
+        for chunk in self._iter_chunks():
+            if pending is not None:
+                chunk = pd.concat([pending, chunk])
+            last = chunk.datetime.iloc[-1]
+            is_last = (chunk.datetime == last).values
+            for dt, rows in chunk[~is_last].groupby('datetime', sort=True):
+                yield dt, rows
+            pending = chunk[is_last]
+        if pending is not None and len(pending):
+            yield pending.datetime.iloc[0], pending
+
+    def _iter_aligned_bars(self):
+        """
+        Yield (datetime, {field: value per symbol}) from start_date on. A symbol without a row
+        keeps its previous bar and is 0 before its first one, as in build_bar_matrices.
+        """
+        last = None
+        prev_close = None
+        for dt, rows in self._iter_slices():
+            if last is None:
+                self.fields = [c for c in rows.columns if c not in ('datetime', 'symbol') and is_numeric_dtype(rows[c])]
+                last = dict((f, np.full(len(self.symbol_list), np.nan)) for f in self.fields)
+
+            positions = np.array([self.symbol_index.get(s, -1) for s in rows.symbol.values], dtype=np.int64)
+            known = positions >= 0
+            for f in self.fields:
+                last[f][positions[known]] = rows[f].values[known]
+
+            bar = dict((f, np.nan_to_num(v, nan=0.0)) for f, v in last.items())
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bar['Pct_change'] = np.full(len(self.symbol_list), np.nan) if prev_close is None \
+                    else bar['close'] / prev_close - 1
+            prev_close = bar['close']
+
+            if dt >= self.start_date:
+                yield dt, bar
+
+    def _get_row(self, symbol):
+        try:
+            return self.symbol_index[symbol]
+        except KeyError:
+            print("That symbol is not available in the historical data set.")
+            raise
+
+    def get_state(self):
+        return {'bar_index': self.bar_index, 'continue_backtest': self.continue_backtest,
+                'buffer': self.buffer, 'buffer_dates': self.buffer_dates, 'buffer_ordinals': self.buffer_ordinals}
+
+    def set_state(self, state):
+        """
+        Skip the stream past the bars already fed and restore the ring buffer. The skipped slices
+        are still read and aligned, since a symbol without a row keeps its previous bar.
+        """
+        self._stream = self._iter_aligned_bars()
+        for _ in itertools.islice(self._stream, state['bar_index']):
+            pass
+        self.bar_index = state['bar_index']
+        self.continue_backtest = state['continue_backtest']
+        self.buffer = state['buffer']
+        self.buffer_dates = state['buffer_dates']
+        self.buffer_ordinals = state['buffer_ordinals']
+
+    def _latest_slots(self, N):
+        N = min(N, self.lookback, self.bar_index)
+        return np.arange(self.bar_index - N, self.bar_index) % self.lookback
+
+    def get_latest_bar(self, symbol):
+        row = self._get_row(symbol)
+        slot = (self.bar_index - 1) % self.lookback
+        return self.buffer_dates[slot], dict((f, m[slot, row]) for f, m in self.buffer.items())
+
+    def get_latest_bars(self, symbol, N=1):
+        row = self._get_row(symbol)
+        return [(self.buffer_dates[slot], dict((f, m[slot, row]) for f, m in self.buffer.items()))
+                for slot in self._latest_slots(N)]
+
+    def get_latest_bar_datetime(self, symbol):
+        self._get_row(symbol)
+        return self.buffer_dates[(self.bar_index - 1) % self.lookback]
+
+    def get_latest_bar_value(self, symbol, val_type="close"):
+        return self.buffer[val_type][(self.bar_index - 1) % self.lookback, self._get_row(symbol)]
+
+    def get_latest_bars_values(self, symbol, val_type="close", N=1):
+        return self.buffer[val_type][self._latest_slots(N), self._get_row(symbol)]
+
+    def get_latest_cross_section(self, val_type="close"):
+        return self.buffer[val_type][(self.bar_index - 1) % self.lookback]
+
+    def get_latest_bar_ordinal(self):
+        return int(self.buffer_ordinals[(self.bar_index - 1) % self.lookback])
+
+    def get_latest_value_by_id(self, symbol_id, val_type="close"):
+        return self.buffer[val_type][(self.bar_index - 1) % self.lookback, symbol_id]
+
+    def update_bars(self):
+        """
+        Read the next time slice into the ring buffer.
+        """
+        try:
+            dt, bar = next(self._stream)
+        except StopIteration:
+            self.continue_backtest = False
+        else:
+            if self.buffer is None:
+                self.buffer = dict((f, np.zeros((self.lookback, len(self.symbol_list)))) for f in bar)
+            slot = self.bar_index % self.lookback
+            self.buffer_dates[slot] = dt
+            self.buffer_ordinals[slot] = date_ordinal(dt)
+            for f, values in bar.items():
+                self.buffer[f][slot] = values
+            self.bar_index += 1
+
+        self.events.put(MarketEvent())
@@ -0,0 +1,175 @@
+# EngineBenchmark.py
+# This file measures engine throughput on synthetic markets. Every scenario runs in a fresh process
+# and times each stage separately; results are written to a JSON baseline for later comparison.
+#
+#   python EngineBenchmark.py --out bench.json [--baseline old.json] [--scenario name=symbols,bars,rebalance]
+
+import argparse
+import contextlib
+import datetime
+import functools
+import io
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SCENARIOS = {
+    'small': (50, 250, 21),
+    'medium': (500, 1000, 21),
+    'wide': (2000, 250, 5),
+}
+
+
+def _timed(func, stage, timings):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timing = timings[stage]
+            timing['seconds'] += time.perf_counter() - start
+            timing['calls'] += 1
+    return wrapper
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_scenario(n_symbols, n_bars, rebalance_every, engine='event', seed=0):
+    """
+    Run one synthetic backtest and time setup, data handler, strategy, portfolio, execution
+    and performance stages. Call in a fresh process for a meaningful peak RSS.
+    """
+    from BacktestController import Backtest
+    from DataHandler import ColumnarDataHandler
+    from EventBuilder import EventBus
+    from Execution import SimulatedExecutionHandler
+    from PerformanceDT import BenchmarkRegistry, Performance
+    from Portfolio import WeightstoPosition
+    from StrategyFactory import Smartbeta
+    from SyntheticMarket import make_market, write_index_files
+
+    stock_data, order_data, signal_data = make_market(n_symbols, n_bars, rebalance_every, seed=seed)
+    symbol_list = stock_data.symbol.unique()
+    start_date = datetime.datetime.strptime(stock_data.datetime.iloc[0], "%Y-%m-%d")
+    timings = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        backtest = Backtest(stock_data=stock_data, symbol_list=symbol_list, order_list=order_data,
+                            signal_list=signal_data, initial_capital=100000000.0, heartbeat=0.0,
+                            start_date=start_date, data_handler_cls=ColumnarDataHandler,
+                            execution_handler_cls=SimulatedExecutionHandler, portfolio_cls=WeightstoPosition,
+                            strategy_cls=Smartbeta, event_queue_cls=EventBus, engine=engine)
+        timings['setup'] = {'seconds': time.perf_counter() - start, 'calls': 1}
+
+        stages = {'MARKET': 'strategy', 'SIGNAL': 'portfolio', 'ORDER': 'execution', 'FILL': 'portfolio'}
+        for event_type, stage in stages.items():
+            backtest.handlers[event_type] = _timed(backtest.handlers[event_type], stage, timings)
+        backtest.data_handler.update_bars = _timed(backtest.data_handler.update_bars, 'data_handler', timings)
+        backtest.portfolio.update_timeindex = _timed(backtest.portfolio.update_timeindex, 'portfolio', timings)
+
+        start = time.perf_counter()
+        backtest.run_engine()
+        run_seconds = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp:
+            csi_path, spx_path = write_index_files(stock_data.datetime.unique(), tmp, seed=seed)
+            registry = BenchmarkRegistry()
+            registry.register("CSI", csi_path)
+            registry.register("SPX", spx_path, date_format="%Y/%m/%d")
+            start = time.perf_counter()
+            performance = Performance(backtest.portfolio, registry=registry)
+            performance.calculate_metrics()
+            timings['performance'] = {'seconds': time.perf_counter() - start, 'calls': 1}
+
+    n_events = sum(backtest.event_counts.values())
+    return {
+        'params': {'n_symbols': n_symbols, 'n_bars': n_bars, 'rebalance_every': rebalance_every,
+                   'engine': engine, 'seed': seed},
+        'stages': dict(timings),
+        'run_seconds': run_seconds,
+        'bars_per_sec': backtest.portfolio.n_records / run_seconds,
+        'events_per_sec': n_events / run_seconds,
+        'event_counts': dict(backtest.event_counts),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def run_suite(scenarios=None, engines=('event', 'vectorized')):
+    """
+    Run every scenario with every engine, each in its own process.
+    """
+    if scenarios is None:
+        scenarios = DEFAULT_SCENARIOS
+    results = dict()
+    for name, (n_symbols, n_bars, rebalance_every) in scenarios.items():
+        for engine in engines:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results['%s/%s' % (name, engine)] = pool.submit(
+                    run_scenario, n_symbols, n_bars, rebalance_every, engine).result()
+    return {
+        'meta': {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                 'machine': platform.machine(), 'processor': platform.processor()},
+        'scenarios': results,
+    }
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    List the scenarios whose bars/sec or events/sec fell, or peak RSS rose, by more than tolerance.
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        for key, worse_if_lower in (('bars_per_sec', True), ('events_per_sec', True), ('peak_rss_mb', False)):
+            change = result[key] / base[key] - 1 if base[key] else 0.0
+            if (change < -tolerance) if worse_if_lower else (change > tolerance):
+                regressions.append((name, key, base[key], result[key], change))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure backtest engine throughput on synthetic data.")
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--baseline', help="Earlier --out file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--scenario', action='append', default=[],
+                        help="name=n_symbols,n_bars,rebalance_every; replaces the default scenarios")
+    args = parser.parse_args()
+
+    scenarios = None
+    if args.scenario:
+        scenarios = dict()
+        for spec in args.scenario:
+            name, values = spec.split('=')
+            scenarios[name] = tuple(int(v) for v in values.split(','))
+
+    report = run_suite(scenarios)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in report['scenarios'].items():
+        stages = ', '.join('%s %.3fs' % (k, v['seconds']) for k, v in sorted(result['stages'].items()))
+        print("%-20s %10.0f bars/s %10.0f events/s %8.1f MB  (%s)" % (
+            name, result['bars_per_sec'], result['events_per_sec'], result['peak_rss_mb'], stages))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for name, key, before, after, change in regressions:
+            print("REGRESSION %s %s: %.1f -> %.1f (%+.1f%%)" % (name, key, before, after, 100 * change))
+        sys.exit(1 if regressions else 0)
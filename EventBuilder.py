@@ -1,25 +1,28 @@
 # EventBuilder.py
 # This file creates event elements for event queue.
+import queue
+from collections import deque
+
 
 class Event(object):
-    pass
+    __slots__ = ()
 
 
 class MarketEvent(Event):
-
-    def __init__(self):
-        self.type = "MARKET"
+    __slots__ = ()
+    type = "MARKET"
 
 
 # Strategy signal event.
 class SignalEvent(Event):
+    __slots__ = ('datetime', 'timestamp', 'symbol_id', 'signal_type', 'order_price', 'weight')
+    type = "SIGNAL"
 
-    def __init__(self, datetime, symbol, timestamp, signal_type, order_price, weight=None):
-        self.type = "SIGNAL"
+    def __init__(self, datetime, symbol_id, timestamp, signal_type, order_price, weight=None):
         # self.strategy_id = strategy_id
-        self.datetime = datetime
+        self.datetime = datetime  # Day ordinal, see Universe
         self.timestamp = timestamp
-        self.symbol = symbol
+        self.symbol_id = symbol_id  # Position in the universe's symbol list
         self.signal_type = signal_type
         # self.strength = strength
         self.order_price = order_price
@@ -29,11 +32,12 @@ class SignalEvent(Event):
 
 # Order info generated by portfolio.
 class OrderEvent(Event):
+    __slots__ = ('datetime', 'symbol_id', 'order_type', 'quantity', 'buy_or_sell', 'direction', 'order_price')
+    type = "ORDER"
 
-    def __init__(self, datetime, symbol, order_type, quantity, buy_or_sell, order_price, direction):
-        self.type = "ORDER"
+    def __init__(self, datetime, symbol_id, order_type, quantity, buy_or_sell, order_price, direction):
         self.datetime = datetime
-        self.symbol = symbol
+        self.symbol_id = symbol_id
         self.order_type = order_type  # "MKT" or" LMT"
         self.quantity = quantity
         self.buy_or_sell = buy_or_sell  # "BUY" or "SELL"
@@ -44,7 +48,7 @@ class OrderEvent(Event):
         """
         Print order info.
         print("Order: Symbol:%s, Type=%s, Quantity=%s, Direction=%s, Order_price=%s" %
-              (self.symbol, self.order_type, self.quantity, self.direction, self.order_price))
+              (self.symbol_id, self.order_type, self.quantity, self.direction, self.order_price))
 
         """
         pass
@@ -52,13 +56,14 @@ class OrderEvent(Event):
 
 # The output of order execution.
 class FillEvent(Event):
+    __slots__ = ('datetime', 'symbol_id', 'quantity', 'buy_or_sell', 'fill_cost', 'commission')
+    type = "FILL"
 
-    def __init__(self, datetime, symbol, quantity, buy_or_sell,
+    def __init__(self, datetime, symbol_id, quantity, buy_or_sell,
                  fill_cost, commission=None):
 
-        self.type = "FILL"
         self.datetime = datetime
-        self.symbol = symbol
+        self.symbol_id = symbol_id
         # self.exchange = exchange
         self.quantity = quantity
         self.buy_or_sell = buy_or_sell
@@ -82,3 +87,64 @@ class FillEvent(Event):
         :return:
         """
         pass
+
+
+# Batch events carry one whole rebalance. indices are symbol ids.
+class TargetWeightEvent(Event):
+    __slots__ = ('datetime', 'timestamp', 'indices', 'weights', 'order_prices')
+    type = "TARGET"
+
+    def __init__(self, datetime, timestamp, indices, weights, order_prices):
+        self.datetime = datetime
+        self.timestamp = timestamp
+        self.indices = indices
+        self.weights = weights
+        self.order_prices = order_prices
+
+
+class BatchOrderEvent(Event):
+    __slots__ = ('datetime', 'indices', 'quantities', 'order_prices')
+    type = "BATCH_ORDER"
+
+    def __init__(self, datetime, indices, quantities, order_prices):
+        self.datetime = datetime
+        self.indices = indices
+        self.quantities = quantities  # Signed, positive to buy
+        self.order_prices = order_prices
+
+
+class BatchFillEvent(Event):
+    __slots__ = ('datetime', 'indices', 'quantities', 'fill_prices', 'commission')
+    type = "BATCH_FILL"
+
+    def __init__(self, datetime, indices, quantities, fill_prices, commission):
+        self.datetime = datetime
+        self.indices = indices
+        self.quantities = quantities  # Signed, positive when bought
+        self.fill_prices = fill_prices
+        self.commission = commission
+
+
+class EventBus(object):
+    """
+    Single-threaded FIFO event queue on a deque. It has the put/get/empty interface of
+    queue.Queue without taking a lock on every call.
+    """
+
+    def __init__(self):
+        self._events = deque()
+
+    def put(self, event, block=True, timeout=None):
+        self._events.append(event)
+
+    def get(self, block=True, timeout=None):
+        try:
+            return self._events.popleft()
+        except IndexError:
+            raise queue.Empty
+
+    def empty(self):
+        return not self._events
+
+    def qsize(self):
+        return len(self._events)
@@ -1,11 +1,13 @@
 # Execution.py
 # This file pricess order events and generate fill events by simulating an execution handler.
+import numpy as np
 import pandas as pd
 import queue
 
 from abc import ABCMeta, abstractmethod
 
-from EventBuilder import FillEvent
+from EventBuilder import FillEvent, BatchFillEvent
+from Universe import date_strings
 
 
 class ExecutionHandler(object):
@@ -15,25 +17,120 @@ class ExecutionHandler(object):
     def execute_order(self, event):
         raise NotImplementedError("Should implement execute_order()")
 
+    def execute_batch_order(self, event):
+        raise NotImplementedError("Should implement execute_batch_order()")
+
+
+class ExecutionJournal(object):
+    """
+    Execution records kept in growable typed column arrays and turned into a DataFrame on request.
+    Dates are kept as day ordinals and symbols as ids until then.
+    """
+    columns = [('datetime', np.int64), ('symbol_id', np.int64), ('direction', object),
+               ('quantity', np.int64), ('order_price', np.float64)]
+
+    def __init__(self, capacity=1024):
+        self.n_records = 0
+        self.data = dict((name, np.empty(capacity, dtype=dtype)) for name, dtype in self.columns)
+
+    def __len__(self):
+        return self.n_records
+
+    def _reserve(self, n):
+        capacity = len(self.data['datetime'])
+        if self.n_records + n <= capacity:
+            return
+        while capacity < self.n_records + n:
+            capacity *= 2
+        for name, values in self.data.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.n_records] = values[:self.n_records]
+            self.data[name] = grown
+
+    def append(self, datetime, symbol_id, direction, quantity, order_price):
+        self._reserve(1)
+        i = self.n_records
+        self.data['datetime'][i] = datetime
+        self.data['symbol_id'][i] = symbol_id
+        self.data['direction'][i] = direction
+        self.data['quantity'][i] = quantity
+        self.data['order_price'][i] = order_price
+        self.n_records = i + 1
+
+    def extend(self, datetime, symbol_id, direction, quantity, order_price):
+        """
+        Append many records at once, each argument is a scalar or an array of equal length.
+        """
+        n = len(quantity)
+        self._reserve(n)
+        i = self.n_records
+        self.data['datetime'][i:i + n] = datetime
+        self.data['symbol_id'][i:i + n] = symbol_id
+        self.data['direction'][i:i + n] = direction
+        self.data['quantity'][i:i + n] = quantity
+        self.data['order_price'][i:i + n] = order_price
+        self.n_records = i + n
+
+    def history_columns(self):
+        """
+        The recorded rows of every column, by name. Recorded rows are never changed.
+        """
+        n = self.n_records
+        return dict((name, values[:n]) for name, values in self.data.items())
+
+    def load_history(self, columns):
+        """
+        Replace the records with columns from history_columns().
+        """
+        n = len(columns['datetime'])
+        self.n_records = 0
+        self._reserve(n)
+        for name, values in self.data.items():
+            values[:n] = columns[name]
+        self.n_records = n
+
+    def to_frame(self, universe=None):
+        """
+        Records as a DataFrame with "%Y-%m-%d" dates, and symbols if a universe is given (ids otherwise).
+        """
+        n = self.n_records
+        symbol_ids = self.data['symbol_id'][:n]
+        return pd.DataFrame({
+            'datetime': date_strings(self.data['datetime'][:n]),
+            'symbol': symbol_ids if universe is None else universe.symbols[symbol_ids],
+            'direction': self.data['direction'][:n],
+            'quantity': self.data['quantity'][:n],
+            'order_price': self.data['order_price'][:n],
+        })
+
 
 class SimulatedExecutionHandler(ExecutionHandler):
 
     def __init__(self, events):
         self.commission = 0.003
         self.events = events
-        self.execution_records = pd.DataFrame(columns=['datetime', 'symbol', 'direction', 'quantity', 'order_price'])
+        self.journal = ExecutionJournal()
+        self.universe = None  # Restores symbols in execution_records, set by Backtest
+
+    @property
+    def execution_records(self):
+        return self.journal.to_frame(self.universe)
 
     def execute_order(self, event):
         if event.type == 'ORDER':
             fill_event = FillEvent(event.datetime,
-                                   event.symbol,
+                                   event.symbol_id,
                                    event.quantity, event.buy_or_sell, fill_cost=None, commission=self.commission)
             self.events.put(fill_event)
-            self.execution_records = self.execution_records.append(
-                pd.DataFrame(
-                    {'datetime': [event.datetime], 'symbol': [event.symbol], 'direction': [event.direction],
-                     'quantity': [event.quantity], 'order_price': [event.order_price]
-
-                     }
-                )
-            )
+            self.journal.append(event.datetime, event.symbol_id, event.direction, event.quantity, event.order_price)
+
+    def execute_batch_order(self, event):
+        """
+        Fill every order of a rebalance at its order price with one event.
+        """
+        if event.type == 'BATCH_ORDER':
+            quantities = event.quantities
+            self.events.put(BatchFillEvent(event.datetime, event.indices, quantities, event.order_prices,
+                                           self.commission))
+            self.journal.extend(event.datetime, event.indices, np.where(quantities > 0, 'LONG', 'EXIT'),
+                                np.abs(quantities), event.order_prices)
@@ -0,0 +1,199 @@
+# Instrumentation.py
+# This file provides opt-in timing and profiling of the backtest loop and a rate-limited progress reporter.
+
+import cProfile
+import csv
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+import numpy as np
+
+
+class ProgressReporter(object):
+    """
+    Print the bar count at most once every interval seconds.
+    """
+
+    def __init__(self, interval=5.0, total=None):
+        self.interval = interval
+        self.total = total
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self, i):
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            rate = i / (now - self.start)
+            if self.total:
+                print("Bar %d/%d (%.0f bars/s)" % (i, self.total, rate))
+            else:
+                print("Bar %d (%.0f bars/s)" % (i, rate))
+
+
+class LatencyHistogram(object):
+    """
+    Call latencies in power-of-two nanosecond buckets: bucket k counts latencies in [2**(k-1), 2**k).
+    """
+
+    def __init__(self):
+        self.buckets = np.zeros(64, dtype=np.int64)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def quantile_ns(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile.
+        """
+        if not self.count:
+            return 0
+        k = int(np.searchsorted(np.cumsum(self.buckets), q * self.count))
+        return 2 ** k
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_s': self.total_ns / 1e9,
+            'mean_us': self.total_ns / self.count / 1e3 if self.count else 0.0,
+            'p50_us_upper': self.quantile_ns(0.5) / 1e3,
+            'p99_us_upper': self.quantile_ns(0.99) / 1e3,
+            'max_us': self.max_ns / 1e3,
+            'buckets_ns': dict((2 ** k, int(c)) for k, c in enumerate(self.buckets) if c),
+        }
+
+
+class BacktestProfiler(object):
+    """
+    Instruments a Backtest before its loop starts: handler latency histograms per event type,
+    time in update_bars and update_timeindex (and their batch forms), the deepest event queue seen in each bar, and
+    optional cProfile / tracemalloc capture over a range of bars (first, last), both inclusive.
+    Nothing is wrapped unless a profiler is passed to Backtest, so a plain run pays nothing.
+    The report is written to path at the end of the run, as JSON or CSV by its extension.
+    """
+
+    def __init__(self, path='profile.json', profile_bars=None, trace_memory_bars=None, top=25):
+        self.path = path
+        self.profile_bars = profile_bars
+        self.trace_memory_bars = trace_memory_bars
+        self.top = top
+
+        self.latency = dict()  # Handler or stage name -> LatencyHistogram
+        self.queue_depth = []  # Deepest queue seen in each bar
+        self.bar = 0
+        self._depth = 0
+        self._profile = None
+        self._memory_top = None
+
+    def _wrap(self, name, func, events=None):
+        histogram = self.latency.setdefault(name, LatencyHistogram())
+        clock = time.perf_counter_ns
+
+        def wrapper(*args):
+            start = clock()
+            result = func(*args)
+            histogram.record(clock() - start)
+            if events is not None:
+                depth = events.qsize()
+                if depth > self._depth:
+                    self._depth = depth
+            return result
+        return wrapper
+
+    def instrument(self, backtest):
+        for event_type, handler in backtest.handlers.items():
+            backtest.handlers[event_type] = self._wrap(event_type, handler, backtest.events)
+
+        for name in ('update_bars', 'update_bars_batch'):
+            setattr(backtest.data_handler, name, self._wrap_feed(name, getattr(backtest.data_handler, name)))
+        backtest.portfolio.update_timeindex = self._wrap('update_timeindex', backtest.portfolio.update_timeindex)
+        # With a schedule, covers the whole period; its period-end update_timeindex is also timed on its own
+        backtest.portfolio.update_timeindex_batch = self._wrap('update_timeindex_batch',
+                                                               backtest.portfolio.update_timeindex_batch)
+
+    def _wrap_feed(self, name, func):
+        feed = self._wrap(name, func)
+
+        def on_bar(*args):
+            if self.bar:
+                self.queue_depth.append(self._depth)
+            self._depth = 0
+            self.bar += 1
+            self._stop_capture()  # Before feeding, so the bar after a range is not captured
+            self._start_capture()
+            feed(*args)
+        return on_bar
+
+    def _start_capture(self):
+        if self.profile_bars and self.bar == self.profile_bars[0]:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.trace_memory_bars and self.bar == self.trace_memory_bars[0]:
+            tracemalloc.start()
+
+    def _stop_capture(self):
+        # A range closes when its last bar has been processed, i.e. at the start of the next bar
+        if self.profile_bars and self.bar == self.profile_bars[1] + 1 and self._profile is not None:
+            self._profile.disable()
+        if self.trace_memory_bars and self.bar == self.trace_memory_bars[1] + 1 and tracemalloc.is_tracing():
+            self._take_memory_snapshot()
+
+    def _take_memory_snapshot(self):
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        self._memory_top = [str(stat) for stat in snapshot.statistics('lineno')[:self.top]]
+
+    def finish(self):
+        self.queue_depth.append(self._depth)
+        if self._profile is not None:
+            self._profile.disable()
+        if tracemalloc.is_tracing():
+            self._take_memory_snapshot()
+        if self.path:
+            self.export(self.path)
+
+    def to_dict(self):
+        report = {
+            'bars': self.bar,
+            'latency': dict((name, h.to_dict()) for name, h in self.latency.items()),
+            'queue_depth': self.queue_depth,
+        }
+        if self._profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+            report['cprofile'] = {'bars': list(self.profile_bars), 'stats': stream.getvalue()}
+        if self._memory_top is not None:
+            report['tracemalloc'] = {'bars': list(self.trace_memory_bars), 'top': self._memory_top}
+        return report
+
+    def export(self, path):
+        """
+        Write the report to path. A .csv path gets the latency table, with the queue depth per
+        bar written next to it as <name>_queue_depth.csv; anything else is written as JSON.
+        """
+        if not path.endswith('.csv'):
+            with open(path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+            return
+
+        columns = ['count', 'total_s', 'mean_us', 'p50_us_upper', 'p99_us_upper', 'max_us']
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name'] + columns)
+            for name, histogram in self.latency.items():
+                stats = histogram.to_dict()
+                writer.writerow([name] + [stats[c] for c in columns])
+        with open(path[:-4] + '_queue_depth.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['bar', 'max_queue_depth'])
+            writer.writerows(enumerate(self.queue_depth, 1))
@@ -0,0 +1,122 @@
+# OnlineMetrics.py
+# This file keeps performance metrics up to date while the backtest runs, in O(1) time and memory per bar.
+
+import math
+
+
+class P2Quantile(object):
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain & Chlamtac, 1985):
+    five markers are moved towards their desired positions as observations arrive.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def update(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return float('nan')
+        if len(q) < 5:
+            return q[int(round(self.p * (len(q) - 1)))]
+        return q[2]
+
+
+class OnlineMetrics(object):
+    """
+    Running mean and variance of returns (Welford), running peak and maximum drawdown of the
+    equity, and streaming 1%/5% return quantiles. update() takes the portfolio total once per bar.
+    """
+
+    def __init__(self, initial_equity, window_size=252):
+        self.initial_equity = initial_equity
+        self.window_size = window_size
+        self.last_equity = initial_equity
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.peak = None
+        self.max_drawdown = 0.0
+        self.quantile_05 = P2Quantile(0.05)
+        self.quantile_01 = P2Quantile(0.01)
+
+    def update(self, equity):
+        if self.last_equity:
+            r = equity / self.last_equity - 1
+            self.count += 1
+            delta = r - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (r - self.mean)
+            self.quantile_05.update(r)
+            self.quantile_01.update(r)
+        self.last_equity = equity
+
+        if self.peak is None or equity > self.peak:
+            self.peak = equity
+        elif self.peak > 0:
+            self.max_drawdown = max(self.max_drawdown, 1 - equity / self.peak)
+
+    def update_many(self, equities):
+        for equity in equities:
+            self.update(equity)
+
+    def snapshot(self):
+        """
+        Current values of the metrics calculate_metrics reports at the end of a run, as numbers.
+        VaR is the normal approximation used there; empirical VaR comes from the quantile sketch.
+        """
+        vol = math.sqrt(self.m2 / self.count) if self.count else float('nan')
+        cum_return = self.last_equity / self.initial_equity
+        return {
+            'bars': self.count,
+            'total_return': cum_return - 1,
+            'daily_return': (cum_return - 1) / self.count if self.count else float('nan'),
+            'annual_return': (cum_return - 1) / self.count * self.window_size if self.count else float('nan'),
+            'sharpe_ratio': math.sqrt(self.window_size) * self.mean / vol if vol else float('nan'),
+            'max_drawdown': self.max_drawdown,
+            'volatility': vol,
+            '95%_VaR': -(self.mean - 1.645 * vol),
+            '99%_VaR': -(self.mean - 2.326 * vol),
+            '95%_empirical_VaR': -self.quantile_05.value(),
+            '99%_empirical_VaR': -self.quantile_01.value(),
+        }
@@ -0,0 +1,139 @@
+# ParameterSweep.py
+# This file runs a grid of backtest configurations over a process pool. The preprocessed bar
+# matrices are placed once in shared memory and every worker reads them without a copy.
+
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from BacktestController import Backtest
+from DataHandler import ColumnarDataHandler, build_bar_matrices
+from EventBuilder import EventBus
+from Execution import SimulatedExecutionHandler
+from PerformanceDT import calculate_sharpe_ratio
+from Portfolio import WeightstoPosition
+from StrategyFactory import Smartbeta, load_order_list
+
+
+class SharedBarStore(object):
+    """
+    Bar matrices copied once into shared memory blocks. spec() is a small picklable description
+    that attach() turns back into read-only arrays in another process.
+    """
+
+    def __init__(self, dates, bar_data):
+        self.dates = dates
+        self.blocks = []
+        self.fields = {}
+        for field, matrix in bar_data.items():
+            block = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+            np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=block.buf)[:] = matrix
+            self.blocks.append(block)
+            self.fields[field] = (block.name, matrix.shape, matrix.dtype.str)
+
+    def spec(self):
+        return {'dates': self.dates, 'fields': self.fields}
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_attached = {}  # Per worker process: the blocks it holds open and the arrays over them
+
+
+def attach(spec):
+    """
+    Map the shared blocks described by spec into read-only (dates, bar_data) arrays.
+    """
+    bar_data = {}
+    for field, (name, shape, dtype) in spec['fields'].items():
+        block = shared_memory.SharedMemory(name=name)
+        _attached.setdefault('blocks', []).append(block)
+        matrix = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        matrix.flags.writeable = False
+        bar_data[field] = matrix
+    return spec['dates'], bar_data
+
+
+def _init_worker(spec, symbol_list, signal_list):
+    _attached['bar_arrays'] = attach(spec)
+    _attached['symbol_list'] = symbol_list
+    _attached['signal_list'] = signal_list
+
+
+def make_grid(**axes):
+    """
+    Cartesian product of the given axes as a list of config dicts,
+    e.g. make_grid(order_file=[...], initial_capital=[...], commission=[...]).
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[n] for n in names))]
+
+
+def summarize(portfolio, fills):
+    """
+    Headline statistics from the recorded totals of a finished run.
+    """
+    total = pd.Series(portfolio.total_history[:portfolio.n_records])
+    returns = total.pct_change().iloc[1:]
+    cum_return = (1 + returns).cumprod()
+    return {
+        'final_equity': total.iloc[-1],
+        'total_return': total.iloc[-1] / total.iloc[0] - 1,
+        'annual_return': (cum_return.iloc[-1] - 1) / len(cum_return) * 252,
+        'sharpe_ratio': calculate_sharpe_ratio(returns),
+        'max_drawdown': (1 - cum_return / cum_return.cummax()).max(),
+        'volatility': np.std(returns),
+        'fills': fills,
+    }
+
+
+def _run_config(config):
+    symbol_list = _attached['symbol_list']
+    order_data = config.get('order_list')
+    if order_data is None:
+        order_data = load_order_list(pd.read_csv(config['order_file']).iloc[:, -3:], symbol_list)
+
+    backtest = Backtest(stock_data=None, symbol_list=symbol_list, order_list=order_data,
+                        signal_list=_attached['signal_list'], initial_capital=config['initial_capital'],
+                        heartbeat=0.0, start_date=config['start_date'],
+                        data_handler_cls=functools.partial(ColumnarDataHandler, bar_arrays=_attached['bar_arrays']),
+                        execution_handler_cls=SimulatedExecutionHandler, portfolio_cls=WeightstoPosition,
+                        strategy_cls=Smartbeta, event_queue_cls=EventBus,
+                        engine=config.get('engine', 'vectorized'), commission=config.get('commission'))
+    backtest.run_engine()
+    return summarize(backtest.portfolio, backtest.fills)
+
+
+def run_sweep(stock_data, symbol_list, signal_list, configs, max_workers=None):
+    """
+    Run every config and return one summary row per config. A config holds initial_capital,
+    start_date, either order_file (a CSV path) or order_list (per-symbol dict), and optionally
+    commission and engine ('vectorized' by default).
+    """
+    dates, bar_data = build_bar_matrices(stock_data, symbol_list)
+    with SharedBarStore(dates, bar_data) as store:
+        del bar_data
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(store.spec(), symbol_list, signal_list)) as pool:
+            results = list(pool.map(_run_config, configs))
+
+    rows = []
+    for config, result in zip(configs, results):
+        row = dict((k, v) for k, v in config.items() if k != 'order_list')
+        row.update(result)
+        rows.append(row)
+    return pd.DataFrame(rows)
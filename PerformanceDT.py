@@ -5,7 +5,9 @@ import numpy as np
 import pandas as pd
 import scipy.stats
 import matplotlib.pyplot as plt
-import datetime
+import functools
+import itertools
+import os
 from highcharts import Highstock
 
 
@@ -62,27 +64,55 @@ def calculate_corr(return_df1, return_df2):
     return [coef]
 
 
+class BenchmarkRegistry:
+    """
+    Index price files registered by name. Each file is parsed once, with vectorized date
+    conversion, and cached as date-sorted arrays; ranges are then sliced by binary search.
+    """
+
+    def __init__(self):
+        self.sources = dict()  # name -> (path, date_format)
+        self._cache = dict()  # path -> (modified time, "%Y-%m-%d" dates, close prices)
+
+    def register(self, name, path, date_format=None):
+        self.sources[name] = (path, date_format)
+
+    def _load(self, name):
+        path, date_format = self.sources[name]
+        mtime = os.path.getmtime(path)
+        cached = self._cache.get(path)
+        if cached is None or cached[0] != mtime:
+            data = pd.read_csv(path)
+            dates = pd.to_datetime(data.date, format=date_format)
+            order = np.argsort(dates.values, kind="stable")
+            cached = (mtime, dates.dt.strftime("%Y-%m-%d").values[order], data.close.values.astype(float)[order])
+            self._cache[path] = cached
+        return cached[1], cached[2]
+
+    def get_range(self, name, date_range):
+        """
+        Return the rows from date_range[0] up to, not including, date_range[1].
+        """
+        dates, close = self._load(name)
+        start, end = np.searchsorted(dates, date_range)
+        return pd.DataFrame({"date": dates[start:end], "close": close[start:end]})
+
+
+benchmark_registry = BenchmarkRegistry()
+benchmark_registry.register("CSI", "000800.csv")
+benchmark_registry.register("SPX", "SPX.csv", date_format="%Y/%m/%d")
+
+
 class Benchmark:
-    def __init__(self, symbol, date_range):
+    def __init__(self, symbol, date_range, registry=benchmark_registry):
         self.symbol = symbol
         self.date_range = date_range
+        self.registry = registry
         self._load_data()
         self._calculate_return()
 
     def _load_data(self):
-        if self.symbol == "CSI":
-            csi_data = pd.read_csv('000800.csv')
-            csi_data = csi_data.iloc[csi_data.date.to_list().index(self.date_range[0]):csi_data.date.to_list().index(
-                self.date_range[1]), ]
-            self.data = csi_data
-        elif self.symbol == "SPX":
-            spx_data = pd.read_csv('SPX.csv')
-            spx_data.date = spx_data.date.apply(lambda x: datetime.datetime.strptime(x, "%Y/%m/%d"))
-            spx_data = spx_data.set_index("date").sort_index().reset_index()
-            spx_data.date = spx_data.date.apply(lambda x: datetime.datetime.strftime(x, "%Y-%m-%d"))
-            spx_data = spx_data.iloc[spx_data.date.to_list().index(self.date_range[0]):spx_data.date.to_list().index(
-                self.date_range[1]), ]
-            self.data = spx_data
+        self.data = self.registry.get_range(self.symbol, self.date_range)
 
     def _calculate_return(self):
         self.data = self.data.set_index("date")
@@ -91,32 +121,59 @@ class Benchmark:
 
 
 class Performance:
-    def __init__(self, portfolio_info):
+    """
+    Equity curve, benchmarks and metrics of a finished run. Each is computed on first use and
+    cached, so the CSV output, printed metrics and chart all share one computation.
+    """
+    # Benchmarks reported by default: display name -> name in the benchmark registry
+    default_benchmarks = {"CSI800": "CSI", "SP500": "SPX"}
+
+    def __init__(self, portfolio_info, benchmarks=None, registry=benchmark_registry):
         self.portfolio_info = portfolio_info
-        self.equity_curve = self.create_equity_curve_dataframe()
+        self.benchmark_names = self.default_benchmarks if benchmarks is None else benchmarks
+        self.registry = registry
 
-        self.fig = plt.figure()
-        self.fig.patch.set_facecolor('white')
-        curve_matrix = self.equity_curve.reset_index()
-        self.date_range = [curve_matrix.date.iloc[0], curve_matrix.date.iloc[-1]]
-        self.csi = Benchmark("CSI", self.date_range)
-        self.spx = Benchmark("SPX", self.date_range)
+    @functools.cached_property
+    def equity_curve(self):
+        return self.create_equity_curve_dataframe()
 
+    @functools.cached_property
+    def date_range(self):
+        return [self.equity_curve.index[0], self.equity_curve.index[-1]]
+
+    @functools.cached_property
+    def benchmarks(self):
+        return dict((label, Benchmark(name, self.date_range, self.registry))
+                    for label, name in self.benchmark_names.items())
+
+    @functools.cached_property
+    def fig(self):
+        fig = plt.figure()
+        fig.patch.set_facecolor('white')
+        return fig
+
+    @functools.cached_property
+    def metrics(self):
+        return self._calculate_metrics()
 
     def calculate_metrics(self):
+        return self.metrics
+
+    def _calculate_metrics(self):
         indi_metrics = dict()
         corr_metrics = dict()
         all_metrics = list()
         # VaR_metrics = dict()
         indi_metrics["Strategy"] = calculate_metrics(returns=self.equity_curve.returns,
                                                      cum_return=self.equity_curve.equity_curve)
-        indi_metrics["CSI800"] = calculate_metrics(returns=self.csi.returns, cum_return=self.csi.cum_return)
-        indi_metrics["SP500"] = calculate_metrics(returns=self.spx.returns, cum_return=self.spx.cum_return)
+        for label, benchmark in self.benchmarks.items():
+            indi_metrics[label] = calculate_metrics(returns=benchmark.returns, cum_return=benchmark.cum_return)
         all_metrics.append(pd.concat(indi_metrics, axis=1))
 
-        corr_metrics["Strategy_CSI800"] = calculate_corr(self.equity_curve.returns, self.csi.returns)
-        corr_metrics["Strategy_SP500"] = calculate_corr(self.equity_curve.returns, self.spx.returns)
-        corr_metrics["CSI800_SP500"] = calculate_corr(self.csi.returns, self.spx.returns)
+        for label, benchmark in self.benchmarks.items():
+            corr_metrics["Strategy_" + label] = calculate_corr(self.equity_curve.returns, benchmark.returns)
+        for (label1, benchmark1), (label2, benchmark2) in itertools.combinations(self.benchmarks.items(), 2):
+            corr_metrics[label1 + "_" + label2] = calculate_corr(benchmark1.returns, benchmark2.returns)
         all_metrics.append(pd.DataFrame.from_dict(corr_metrics))
         """
         VaR_metrics["Strategy"] = calculate_VaR(self.equity_curve.returns)
@@ -128,7 +185,7 @@ class Performance:
 
 
     def create_equity_curve_dataframe(self):
-        curve = pd.DataFrame(self.portfolio_info.all_holdings)
+        curve = self.portfolio_info.holdings_frame()
         curve = curve.rename(columns={"datetime": "date"})
         curve.set_index('date', inplace=True)
         curve['returns'] = curve['total'].pct_change()
@@ -141,20 +198,15 @@ class Performance:
         curve = self.equity_curve
         initial_cash = curve.cash.iloc[0]
         # curve = self.equity_curve.iloc[1:,]
-        strategy_pnl = list(curve['equity_curve'].apply(lambda x: (x - 1) * initial_cash))
-        date = list(curve.index.to_series().apply(lambda x: datetime.datetime.strptime(x, '%Y-%m-%d')))
+        strategy_pnl = ((curve['equity_curve'] - 1) * initial_cash).to_list()
+        date = list(pd.to_datetime(curve.index, format='%Y-%m-%d').to_pydatetime())
         strategy_pnl = list(zip(date, strategy_pnl))
 
-        csi_pnl = self.csi.cum_return.apply(lambda x: (x - 1) * initial_cash).to_list()
-        csi_pnl = list(zip(date, csi_pnl))
-
-        spx_pnl = self.spx.cum_return.apply(lambda x: (x - 1) * initial_cash).to_list()
-        spx_pnl = list(zip(date, spx_pnl))
-
         PnL = Highstock(width=1000, height=600)
         PnL.add_data_set(strategy_pnl, name="Strategy")
-        PnL.add_data_set(csi_pnl, name="CSI800")
-        PnL.add_data_set(spx_pnl, name="SP500")
+        for label, benchmark in self.benchmarks.items():
+            benchmark_pnl = ((benchmark.cum_return - 1) * initial_cash).to_list()
+            PnL.add_data_set(list(zip(date, benchmark_pnl)), name=label)
         PnL.set_dict_options(
 
             {
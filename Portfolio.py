@@ -6,14 +6,55 @@ import math
 import datetime
 
 from abc import ABCMeta, abstractmethod
+from collections.abc import MutableMapping
 
-from EventBuilder import SignalEvent, OrderEvent
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from EventBuilder import SignalEvent, OrderEvent, BatchOrderEvent
+from OnlineMetrics import OnlineMetrics
+
+
+class SymbolArrayMap(MutableMapping):
+    """
+    Dict-like access by symbol to a NumPy vector, plus a few scalar entries (cash, total, ...).
+    """
+
+    def __init__(self, symbol_index, values, **extras):
+        self.symbol_index = symbol_index
+        self.values = values
+        self.extras = extras
+
+    def __getitem__(self, key):
+        if key in self.symbol_index:
+            return self.values[self.symbol_index[key]]
+        return self.extras[key]
+
+    def __setitem__(self, key, value):
+        if key in self.symbol_index:
+            self.values[self.symbol_index[key]] = value
+        else:
+            self.extras[key] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Entries of a SymbolArrayMap can not be deleted")
+
+    def __iter__(self):
+        yield from self.symbol_index
+        yield from self.extras
+
+    def __len__(self):
+        return len(self.symbol_index) + len(self.extras)
 
 
 class Portfolio(object):
     """
     Portfolio class receive signal events, generates order events and deal with fill events.
+    Positions and holdings history are kept in preallocated (time x symbol) arrays.
     """
+    history_names = ('datetime_history', 'position_history', 'holding_history',
+                     'cash_history', 'commission_history', 'total_history')
 
     def __init__(self, bars, events, start_date, initial_capital):
 
@@ -21,15 +62,17 @@ class Portfolio(object):
         self.events = events
 
         self.symbol_list = self.bars.symbol_list
+        self.universe = self.bars.universe
+        self.symbol_index = self.universe.ids
         self.latest_datetime = None
         self.start_date = start_date
         self.initial_capital = initial_capital
 
-        self.all_positions = self._construct_all_positions()
-        self.current_positions = dict((k, v) for k, v in
-                                      [(s, 0) for s in self.symbol_list])
-        self.all_holdings = self._construct_all_holdings()
+        self._construct_history((self.bars.get_bar_count() or 255) + 2)  # Initial row and the final repeated bar
+        self.current_positions = SymbolArrayMap(self.symbol_index, np.zeros(len(self.symbol_list), dtype=np.int64))
         self.current_holdings = self._construct_current_holdings()
+        self._record_timeindex(self.start_date)
+        self.live_metrics = OnlineMetrics(self.initial_capital)  # Query with live_metrics.snapshot()
 
     @abstractmethod
     def generate_order(self, signal):
@@ -40,45 +83,175 @@ class Portfolio(object):
             order_event = self.generate_order(event)
             self.events.put(order_event)
 
+    def generate_batch_order(self, target):
+        raise NotImplementedError("Should implement generate_batch_order()")
+
+    def process_target(self, event):
+        if event.type == 'TARGET':
+            order_event = self.generate_batch_order(event)
+            if order_event is not None:
+                self.events.put(order_event)
+
     # Record positions and holdings
-    def _construct_all_positions(self):
-        d = dict((k, v) for k, v in [(s, 0.0) for s in self.symbol_list])
-        d['datetime'] = self.start_date
-        return [d]
-
-    def _construct_all_holdings(self):
-        d = dict((k, v) for k, v in [(s, 0.0) for s in self.symbol_list])
-        d['cash'] = self.initial_capital
-        d['commission'] = 0.0
-        d['total'] = self.initial_capital
-        return [d]
+    def _construct_history(self, capacity):
+        n = len(self.symbol_list)
+        self.n_records = 0
+        self.datetime_history = np.empty(capacity, dtype=object)
+        self.position_history = np.zeros((capacity, n), dtype=np.int64)
+        self.holding_history = np.zeros((capacity, n))
+        self.cash_history = np.zeros(capacity)
+        self.commission_history = np.zeros(capacity)
+        self.total_history = np.zeros(capacity)
+
+    def _grow_history(self):
+        capacity = 2 * len(self.datetime_history)
+        for name in self.history_names:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
 
     def _construct_current_holdings(self):
-        d = dict((k, v) for k, v in [(s, 0.0) for s in self.symbol_list])
-        d['cash'] = self.initial_capital
-        d['commission'] = 0.0
-        d['total'] = self.initial_capital
-        return d
+        return SymbolArrayMap(self.symbol_index, np.zeros(len(self.symbol_list)),
+                              cash=self.initial_capital, commission=0.0, total=self.initial_capital)
+
+    def _record_timeindex(self, dt, total=None):
+        t = self.n_records
+        if t == len(self.datetime_history):
+            self._grow_history()
+        self.datetime_history[t] = dt
+        self.position_history[t] = self.current_positions.values
+        self.holding_history[t] = self.current_holdings.values
+        self.cash_history[t] = self.current_holdings['cash']
+        self.commission_history[t] = self.current_holdings['commission']
+        self.total_history[t] = self.current_holdings['total'] if total is None else total
+        self.n_records = t + 1
 
     def update_timeindex(self):
 
         self.latest_datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
-        # self.latest_datetime = order.datetime
-        dp = dict((k, v) for k, v in [(s, 0) for s in self.symbol_list])
-        dp['datetime'] = self.latest_datetime
-        dp.update(self.current_positions)
-        self.all_positions.append(dp)
-
-        dh = dict((k, v) for k, v in [(s, 0) for s in self.symbol_list])
-        dh['datetime'] = self.latest_datetime
-        dh['cash'] = self.current_holdings['cash']
-        dh['commission'] = self.current_holdings['commission']
-        dh['total'] = self.current_holdings['cash']
-        for s in self.symbol_list:
-            self.current_holdings[s] = self.current_positions[s] * self.bars.get_latest_bar_value(s)
-            dh[s] = self.current_holdings[s]
-            dh['total'] += self.current_holdings[s]
-        self.all_holdings.append(dh)
+        prices = self.bars.get_latest_cross_section("close")
+        positions = self.current_positions.values
+        np.multiply(positions, prices, out=self.current_holdings.values)
+        # Only the recorded total is marked to market, current_holdings['total'] keeps its value
+        total = self.current_holdings['cash'] + positions.dot(prices)
+        self._record_timeindex(self.latest_datetime, total=total)
+        self.live_metrics.update(total)
+
+    def update_timeindex_block(self, datetimes, prices):
+        """
+        Record several time indexes at once, holding positions fixed. prices is (time x symbol).
+        """
+        positions = self.current_positions.values
+        n = len(datetimes)
+        while self.n_records + n > len(self.datetime_history):
+            self._grow_history()
+        t = self.n_records
+        self.datetime_history[t:t + n] = datetimes
+        self.position_history[t:t + n] = positions
+        np.multiply(prices, positions, out=self.holding_history[t:t + n])
+        self.cash_history[t:t + n] = self.current_holdings['cash']
+        self.commission_history[t:t + n] = self.current_holdings['commission']
+        self.total_history[t:t + n] = self.current_holdings['cash'] + prices.dot(positions)
+        self.n_records = t + n
+        self.live_metrics.update_many(self.total_history[t:t + n])
+        if n:
+            self.latest_datetime = datetimes[-1]
+            self.current_holdings.values[:] = self.holding_history[t + n - 1]
+
+    def update_timeindex_batch(self):
+        """
+        Record the bars fed by the last update_bars_batch(): those before the period end as one
+        block, the period end itself through update_timeindex().
+        """
+        datetimes, prices = self.bars.get_latest_block("close")
+        self.update_timeindex_block(datetimes[:-1], prices[:-1])
+        self.update_timeindex()
+
+    def history_columns(self):
+        """
+        The recorded rows of every history array, by name. Recorded rows are never changed.
+        """
+        n = self.n_records
+        return dict((name, getattr(self, name)[:n]) for name in self.history_names)
+
+    def load_history(self, columns):
+        """
+        Replace the history with columns from history_columns().
+        """
+        n = len(columns['datetime_history'])
+        while n > len(self.datetime_history):
+            self._grow_history()
+        for name in self.history_names:
+            getattr(self, name)[:n] = columns[name]
+        self.n_records = n
+
+    def get_state(self):
+        """
+        Current positions and holdings, the latest datetime and the live metrics.
+        """
+        return {'positions': self.current_positions.values.copy(),
+                'holdings': self.current_holdings.values.copy(),
+                'holding_extras': dict(self.current_holdings.extras),
+                'latest_datetime': self.latest_datetime,
+                'live_metrics': self.live_metrics}
+
+    def set_state(self, state):
+        self.current_positions.values[:] = state['positions']
+        self.current_holdings.values[:] = state['holdings']
+        self.current_holdings.extras.update(state['holding_extras'])
+        self.latest_datetime = state['latest_datetime']
+        self.live_metrics = state['live_metrics']
+
+    def _history_frame(self, history, extra_columns):
+        n = self.n_records
+        frame = pd.DataFrame(history[:n], columns=self.symbol_list)
+        frame['datetime'] = pd.Series(self.datetime_history[:n], dtype=object)
+        for name, values in extra_columns:
+            frame[name] = values[:n]
+        return frame
+
+    def positions_frame(self):
+        """
+        Positions history as a DataFrame, one row per time index.
+        """
+        return self._history_frame(self.position_history, [])
+
+    def holdings_frame(self):
+        """
+        Holdings history as a DataFrame, one row per time index.
+        """
+        return self._history_frame(self.holding_history, [('cash', self.cash_history),
+                                                          ('commission', self.commission_history),
+                                                          ('total', self.total_history)])
+
+    def weights_matrix(self):
+        """
+        (time x symbol) weight of every holding in the invested value (total - cash) of each time
+        index, in one broadcast division. Rows with nothing invested are NaN.
+        """
+        n = self.n_records
+        invested = self.total_history[:n] - self.cash_history[:n]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = self.holding_history[:n] / invested[:, None]
+        weights[invested == 0] = np.nan
+        return weights
+
+    def weights_sparse(self):
+        """
+        weights_matrix() as a CSR matrix holding only the nonzero weights; rows with nothing invested are empty.
+        """
+        weights = self.weights_matrix()
+        weights[np.isnan(weights)] = 0.0
+        return sparse.csr_matrix(weights)
+
+    @property
+    def all_positions(self):
+        return self.positions_frame().to_dict('records')
+
+    @property
+    def all_holdings(self):
+        return self.holdings_frame().to_dict('records')
 
     def update_positions_from_fill(self, fill_event):
         fill_dir = 0
@@ -86,7 +259,7 @@ class Portfolio(object):
             fill_dir = 1
         if fill_event.buy_or_sell == 'SELL':
             fill_dir = -1
-        self.current_positions[fill_event.symbol] += fill_dir * fill_event.quantity
+        self.current_positions.values[fill_event.symbol_id] += fill_dir * fill_event.quantity
 
     def update_holdings_from_fill(self, fill_event):
         fill_dir = 0
@@ -95,9 +268,9 @@ class Portfolio(object):
         if fill_event.buy_or_sell == 'SELL':
             fill_dir = -1
 
-        fill_price = self.bars.get_latest_bar_value(fill_event.symbol)
+        fill_price = self.bars.get_latest_value_by_id(fill_event.symbol_id)
         cost = fill_dir * fill_price * fill_event.quantity
-        self.current_holdings[fill_event.symbol] += cost
+        self.current_holdings.values[fill_event.symbol_id] += cost
         self.current_holdings['commission'] += fill_event.commission * fill_price * fill_event.quantity
         self.current_holdings['cash'] -= (cost + fill_event.commission * fill_price * fill_event.quantity)
 
@@ -106,27 +279,79 @@ class Portfolio(object):
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
 
+    def process_batch_fill(self, event):
+        if event.type == 'BATCH_FILL':
+            self.apply_fills(event.indices, event.quantities, event.fill_prices, event.commission)
+
+    def apply_fills(self, indices, quantities, fill_prices, commission):
+        """
+        Vectorized process_fill: signed quantities for the symbols at indices, filled at fill_prices.
+        """
+        cost = quantities * fill_prices
+        fees = commission * fill_prices * np.abs(quantities)
+        self.current_positions.values[indices] += quantities
+        self.current_holdings.values[indices] += cost
+        self.current_holdings['commission'] += fees.sum()
+        self.current_holdings['cash'] -= (cost + fees).sum()
+
+
+class RebalanceSizer(object):
+    """
+    Turn a whole target-weight vector into order quantities against one equity snapshot, so the
+    result does not depend on the order the symbols are visited in. With cash_feasible set, buys
+    are scaled down to what the cash plus the proceeds of the sells can pay for, fees included.
+    """
+
+    def __init__(self, commission=0.003, cash_feasible=False):
+        self.commission = commission
+        self.cash_feasible = cash_feasible
+
+    def target_quantities(self, equity, weights, prices):
+        with np.errstate(divide='raise', invalid='raise'):
+            return np.floor((equity * weights) * (1 - self.commission) / prices).astype(np.int64)
+
+    def size(self, equity, weights, prices, positions, cash=None):
+        """
+        Signed quantities to trade to move positions to the target weights.
+        """
+        delta = self.target_quantities(equity, weights, prices) - positions
+        if self.cash_feasible and cash is not None:
+            delta = self._scale_buys(delta, prices, cash)
+        return delta
+
+    def _scale_buys(self, delta, prices, cash):
+        buys = delta > 0
+        value = delta * prices
+        cost = value[buys].sum() * (1 + self.commission)
+        available = cash - value[~buys].sum() * (1 - self.commission)
+        if cost > available:
+            delta = delta.copy()
+            delta[buys] = np.floor(delta[buys] * (max(available, 0.0) / cost)).astype(np.int64)
+        return delta
+
 
 class WeightstoPosition(Portfolio):
+    commission = 0.003  # Commission rate assumed when sizing orders, Backtest aligns it with the execution handler
+    cash_feasible = False  # Scale batch buys to the cash available, see RebalanceSizer
 
     def generate_order(self, signal):
 
-        symbol = signal.symbol
+        symbol_id = signal.symbol_id
         datetime = signal.datetime
         weight = signal.weight
         order_price = signal.order_price
         order = None
         order_type = 'MKT'
 
-        cur_position = self.current_positions[symbol]
+        cur_position = self.current_positions.values[symbol_id]
 
-        commission = 0.003
+        commission = self.commission
         # free_cash = self.current_holdings['cash']
         total_equity = self.current_holdings['total']
         """
                 if cur_position < 1/10000:
             print("Stopping Loss")
-            order = OrderEvent(datetime, symbol, order_type, 0, 'SELL', order_price,
+            order = OrderEvent(datetime, symbol_id, order_type, 0, 'SELL', order_price,
                                direction="LONG")
             return order
         """
@@ -137,11 +362,25 @@ class WeightstoPosition(Portfolio):
 
             direction = "LONG"
 
-            order = OrderEvent(datetime, symbol, order_type, mkt_quantity - cur_position, 'BUY', order_price,
+            order = OrderEvent(datetime, symbol_id, order_type, mkt_quantity - cur_position, 'BUY', order_price,
                                direction)
         elif mkt_quantity < cur_position:
             direction = "EXIT"
 
-            order = OrderEvent(datetime, symbol, order_type, abs(cur_position - mkt_quantity), 'SELL', order_price,
+            order = OrderEvent(datetime, symbol_id, order_type, abs(cur_position - mkt_quantity), 'SELL', order_price,
                                direction)
         return order
+
+    def generate_batch_order(self, target):
+        """
+        Size every target weight of a rebalance at once, as generate_order does one by one.
+        """
+        indices = target.indices
+        sizer = RebalanceSizer(self.commission, self.cash_feasible)
+        delta = sizer.size(self.current_holdings['total'], target.weights, target.order_prices,
+                           self.current_positions.values[indices], cash=self.current_holdings['cash'])
+        traded = delta != 0
+        if not traded.any():
+            return None
+        indices = indices[traded]
+        return BatchOrderEvent(target.datetime, indices, delta[traded], target.order_prices[traded])
@@ -0,0 +1,280 @@
+# ScenarioAnalysis.py
+# This file estimates how the portfolio would react to market and drawdown shocks. For every
+# held stock the index is regressed on the stock over an expanding window, and the portfolio
+# exposure is the holdings-weighted sum of the coefficients.
+
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from DataHandler import BarCache
+
+MARKET_SHOCKS = (-0.05, -0.1)
+DRAWDOWN_SHOCKS = (-0.2, -0.3, -0.5)
+
+
+def calculate_drawdowns(cum_return):
+    # By using a rolling maximum
+    roll_max = cum_return.cummax()
+    # Calculate the drawdown by computing the falling ratio from the maximum return
+    return 1 - cum_return / roll_max
+
+
+def stock_return_matrices(stock_data):
+    """
+    Daily returns and drawdowns as (date x stock) DataFrames from rows of datetime, symbol and close.
+    A return is taken against the stock's previous bar, and is NaN where the stock has no bar.
+    """
+    close = stock_data.pivot(index='datetime', columns='symbol', values='close')
+    close.index = pd.to_datetime(close.index)
+    returns = close.ffill().pct_change().where(close.notna())
+    drawdowns = calculate_drawdowns(close.where(returns.notna()))  # From the second bar, as (1 + returns).cumprod()
+    return returns, drawdowns
+
+
+def index_return_series(index_data):
+    """
+    Daily returns and drawdowns of an index file with date and close columns.
+    """
+    close = index_data.set_index(pd.to_datetime(index_data.date)).close
+    returns = close.pct_change()
+    drawdowns = calculate_drawdowns((1 + returns).cumprod().dropna(axis=0))
+    return returns, drawdowns
+
+
+def holdings_weights(holdings):
+    """
+    Weight of every stock in the invested part of the portfolio, from a Portfolio or from a
+    date-indexed frame of holdings with cash and total columns. Dates with nothing invested are dropped.
+    """
+    if hasattr(holdings, 'weights_matrix'):  # A Portfolio
+        weights = pd.DataFrame(holdings.weights_matrix(), columns=holdings.symbol_list,
+                               index=holdings.datetime_history[:holdings.n_records])
+    else:
+        stocks = holdings.columns.drop(['cash', 'commission', 'total', 'returns', 'equity_curve'], errors='ignore')
+        invested = (holdings.total - holdings.cash).values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = pd.DataFrame(holdings[stocks].values / invested[:, None], index=holdings.index, columns=stocks)
+    weights = weights[np.isfinite(weights.values).all(axis=1)]
+    weights.index = pd.to_datetime(weights.index)
+    return weights
+
+
+def expanding_ols(x, y):
+    """
+    Fit y = alpha + beta * x over the expanding window ending at every row, for every column of x
+    at once, from running sums of x, y, x*x, x*y and y*y. Rows where x or y is NaN are left out.
+    Returns alpha, beta and the residual sum of squares, each shaped like x. Coefficients are NaN
+    until they are determined; the residual sum is 0 until there are more points than coefficients.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).reshape(-1, 1)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    xv = np.where(valid, x, 0.0)
+    yv = np.where(valid, y, 0.0)
+
+    n = np.cumsum(valid, axis=0)
+    sx = np.cumsum(xv, axis=0)
+    sy = np.cumsum(yv, axis=0)
+    sxx = np.cumsum(xv * xv, axis=0)
+    sxy = np.cumsum(xv * yv, axis=0)
+    syy = np.cumsum(yv * yv, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = n * sxx - sx * sx
+        determined = denominator > 1e-12 * n * sxx
+        beta = np.where(determined, (n * sxy - sx * sy) / denominator, np.nan)
+        alpha = np.where(determined, (sy - beta * sx) / n, np.nan)
+        ssr = np.where(determined & (n > 2), np.maximum(syy - alpha * sy - beta * sxy, 0.0), 0.0)
+    return alpha, beta, ssr
+
+
+def weighted_exposures(weights, x, y):
+    """
+    Holdings-weighted alpha, beta and residual sum of squares on every date of weights. x holds the
+    stock series (date x stock) and y the index series; the regressions start at the first date of
+    weights. Stocks not held on a date, and coefficients not yet determined, contribute nothing.
+    """
+    weights = weights.loc[:, (weights.values != 0).any(axis=0)]
+    start_date = weights.index[0]
+    x = x.loc[start_date:, weights.columns]
+    y = y.reindex(x.index)
+    rows = _weight_rows(x.index, weights.index)
+    sums = _exposure_sums(sparse.csr_matrix(weights.values), x.values, y.values, rows)
+    return pd.DataFrame(sums, index=weights.index, columns=['alpha', 'beta', 'epsilon'])
+
+
+def _weight_rows(dates, weight_dates):
+    rows = dates.get_indexer(weight_dates)
+    if (rows < 0).any():
+        raise KeyError("No stock data on %s" % list(weight_dates[rows < 0]))
+    return rows
+
+
+def _exposure_sums(weights, x, y, rows):
+    """
+    (date x 3) holdings-weighted alpha, beta and residual sums. weights is a (date x stock) CSR
+    matrix, so only the held entries are read; rows are the positions of its dates in x and y.
+    """
+    alpha, beta, ssr = expanding_ols(x, y)
+    n_dates = weights.shape[0]
+    dates = np.repeat(np.arange(n_dates), np.diff(weights.indptr))
+    at = rows[dates]
+    return np.column_stack([np.bincount(dates, weights.data * np.nan_to_num(v[at, weights.indices]), minlength=n_dates)
+                            for v in (alpha, beta, ssr)])
+
+
+def shock_table(exposures, shocks):
+    """
+    alpha + beta * shock + epsilon for every shock, one column per shock.
+    """
+    values = exposures.alpha.values[:, None] + np.outer(exposures.beta.values, shocks) + \
+        exposures.epsilon.values[:, None]
+    return pd.DataFrame(values, index=exposures.index, columns=[str(s) for s in shocks])
+
+
+def run_scenario_analysis(stock_data, index_data, holdings,
+                          market_shocks=MARKET_SHOCKS, drawdown_shocks=DRAWDOWN_SHOCKS):
+    """
+    Return (market shock table, drawdown shock table) for a holdings history.
+    """
+    stock_return, stock_dd = stock_return_matrices(stock_data)
+    index_return, index_dd = index_return_series(index_data)
+    weights = holdings_weights(holdings)
+
+    rp = shock_table(weighted_exposures(weights, stock_return, index_return), market_shocks)
+    ddp = shock_table(weighted_exposures(weights, stock_dd, index_dd), drawdown_shocks)
+    return rp, ddp
+
+
+def write_return_store(stock_data, path):
+    """
+    Write the (date x stock) return and drawdown matrices to path as raw .npy files plus a
+    manifest.json of symbols and dates.
+    """
+    returns, drawdowns = stock_return_matrices(stock_data)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'returns.npy'), np.ascontiguousarray(returns.values))
+    np.save(os.path.join(path, 'drawdowns.npy'), np.ascontiguousarray(drawdowns.values))
+    manifest = {'symbols': list(returns.columns), 'dates': list(returns.index.strftime("%Y-%m-%d")),
+                'fields': ['returns', 'drawdowns']}
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+
+def open_return_store(path):
+    """
+    Open a store written by write_return_store. Returns (symbols, dates, {field: matrix}) with the
+    matrices memory-mapped read-only.
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    matrices = dict((field, np.load(os.path.join(path, field + '.npy'), mmap_mode='r'))
+                    for field in manifest['fields'])
+    return pd.Index(manifest['symbols']), pd.to_datetime(manifest['dates']), matrices
+
+
+class ReturnCache(BarCache):
+    """
+    Return stores on disk keyed by a hash of the datetime, symbol and close columns, evicted like BarCache.
+    """
+
+    def __init__(self, path='.scenario_cache', max_bytes=2 * 1024 ** 3):
+        super(ReturnCache, self).__init__(path, max_bytes)
+
+    @staticmethod
+    def key(stock_data):
+        digest = hashlib.sha1()
+        digest.update(pd.util.hash_pandas_object(stock_data[['datetime', 'symbol', 'close']], index=False).values.tobytes())
+        return digest.hexdigest()
+
+    def load(self, stock_data):
+        """
+        Return the path of the store for stock_data, building it on a miss.
+        """
+        key = self.key(stock_data)
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            os.utime(os.path.join(entry, 'manifest.json'))  # Mark as recently used
+        else:
+            tmp = '%s.%d.tmp' % (entry, os.getpid())
+            write_return_store(stock_data, tmp)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not os.path.isdir(entry):  # Only a lost race if another process stored the key first
+                    raise
+            self._evict(keep=key)
+        return entry
+
+
+def _run_shard(entry, columns, start, rows, weights, index_series):
+    """
+    Exposure sums of one group of stocks for every field, read from the return store at entry.
+    """
+    _, _, matrices = open_return_store(entry)
+    return dict((field, _exposure_sums(weights, matrices[field][start:, columns], y, rows))
+                for field, y in index_series.items())
+
+
+class ScenarioEngine(object):
+    """
+    Scenario analysis over a process pool. Stock return and drawdown matrices are cached on disk
+    and read memory-mapped by the workers. The held stocks are split into shards of shard_size,
+    each worker fits and weights its shard for every date, and the shard sums are added up, since
+    portfolio exposures are sums over stocks. The shock grid is applied to the summed exposures.
+    """
+
+    def __init__(self, stock_data, index_data, cache=None, max_workers=None, shard_size=256):
+        self.stock_data = stock_data
+        self.cache = ReturnCache() if cache is None else cache
+        self.max_workers = max_workers
+        self.shard_size = shard_size
+        self.index_return, self.index_dd = index_return_series(index_data)
+
+    def exposures(self, holdings):
+        """
+        Holdings-weighted alpha, beta and epsilon per date, for returns and for drawdowns.
+        """
+        weights = holdings_weights(holdings)
+        held = weights.columns[(weights.values != 0).any(axis=0)]
+        weights = weights[held]
+        held_weights = sparse.csr_matrix(weights.values)
+
+        entry = self.cache.load(self.stock_data)
+        symbols, dates, _ = open_return_store(entry)
+        columns = symbols.get_indexer(held)
+        if (columns < 0).any():
+            raise KeyError("No stock data for %s" % list(held[columns < 0]))
+        start = int(dates.searchsorted(weights.index[0]))
+        rows = _weight_rows(dates[start:], weights.index)
+        index_series = {'returns': self.index_return.reindex(dates[start:]).values,
+                        'drawdowns': self.index_dd.reindex(dates[start:]).values}
+
+        shards = [slice(i, i + self.shard_size) for i in range(0, len(held), self.shard_size)]
+        tasks = [(entry, columns[k], start, rows, held_weights[:, k], index_series) for k in shards]
+        if self.max_workers == 1 or len(tasks) <= 1:
+            results = [_run_shard(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(_run_shard, *zip(*tasks)))
+
+        exposures = dict()
+        for field in index_series:
+            sums = sum((r[field] for r in results), np.zeros((len(weights), 3)))
+            exposures[field] = pd.DataFrame(sums, index=weights.index, columns=['alpha', 'beta', 'epsilon'])
+        return exposures
+
+    def run(self, holdings, market_shocks=MARKET_SHOCKS, drawdown_shocks=DRAWDOWN_SHOCKS):
+        """
+        Return (market shock table, drawdown shock table) for a Portfolio or a holdings frame.
+        """
+        exposures = self.exposures(holdings)
+        return shock_table(exposures['returns'], market_shocks), shock_table(exposures['drawdowns'], drawdown_shocks)
@@ -8,12 +8,40 @@ import queue
 
 from abc import ABCMeta, abstractmethod
 
-from EventBuilder import SignalEvent
+from EventBuilder import SignalEvent, TargetWeightEvent
+from Universe import date_ordinals
+
+
+def load_order_list(orders, symbol_list):
+    """
+    Split an order file (date, stock, weight columns) into one date-sorted DataFrame per symbol,
+    converting Wind suffixes (.SZ/.SH) to Ricequant ones (.XSHE/.XSHG).
+    """
+    orders = orders.copy()
+    orders['stock'] = orders.stock.str.replace('SZ$', 'XSHE', regex=True).str.replace('SH$', 'XSHG', regex=True)
+    grouped = dict(tuple(orders.groupby('stock', sort=False)))
+    empty = orders.iloc[:0]
+
+    order_data = {}
+    for s in symbol_list:
+        orderlist = grouped.get(s, empty)
+        order_data[s] = orderlist.set_index('date').sort_index().reset_index()
+    return order_data
 
 
 class Strategy(object):
     __metaclass__ = ABCMeta
 
+    lookback = None  # Number of latest bars the strategy reads, None for the full history
+    batch_signals = False  # Emit one TargetWeightEvent per rebalance instead of a SignalEvent per symbol
+
+    @classmethod
+    def required_symbols(cls, order_list):
+        """
+        Symbols the strategy can trade given its orders, or None if it may need any symbol.
+        """
+        return None
+
     @abstractmethod
     def _generate_position_state(self):
         pass
@@ -26,8 +54,19 @@ class Strategy(object):
     def calculate_stopping(self):
         pass
 
+    def get_state(self):
+        """
+        Picklable state that changes while the backtest runs, restored by set_state().
+        """
+        return {'reading_orders': self.reading_orders}
+
+    def set_state(self, state):
+        self.reading_orders = state['reading_orders']
+
 
 class Smartbeta(Strategy):
+    lookback = 1
+
     def __init__(self, bars, events, order_list,signal_list):
         self.bars = bars
         self.events = events
@@ -40,57 +79,61 @@ class Smartbeta(Strategy):
         self.symbol_list = self.bars.symbol_list
         self.bought = self._generate_position_state()
         signals = self.signal_list.reset_index()
-        self.signal_date_list = signals.Date.to_list()
+        self.rms_signals = dict(zip(date_ordinals(signals.Date.values).tolist(), signals.signal))  # Day ordinal -> signal
+        self.rebalance_index = self._build_rebalance_index()
+
+    @classmethod
+    def required_symbols(cls, order_list):
+        # Only symbols with orders are ever bought. RMS clears signal every priced symbol, so with
+        # fewer symbols loaded they emit fewer signals; the ones dropped were never held
+        return [s for s, orders in order_list.items() if len(orders)]
+
+    def _build_rebalance_index(self):
+        """
+        Map the day ordinal of each order date to the ids of the symbols that trade on it and their
+        weights. A symbol listed twice on one date keeps its first weight.
+        """
+        by_date = {}
+        for i, s in enumerate(self.symbol_list):
+            if s not in self.order_list:
+                continue
+            orders = self.order_list[s]
+            for date, weight in zip(date_ordinals(orders.date.values).tolist(), orders.iloc[:, 2].values):
+                by_date.setdefault(date, {}).setdefault(i, weight)
+
+        rebalance_index = {}
+        for date, weights in by_date.items():
+            indices = np.array(sorted(weights), dtype=np.int64)
+            rebalance_index[date] = (indices, np.array([weights[i] for i in indices]))
+        return rebalance_index
 
     def calculate_signals(self, event):
         if event.type == 'MARKET':
             if not self.reading_orders:
-                for s in self.symbol_list:
-                    date_cur = self.bars.get_latest_bar_datetime(s)
-                   
-                    if date_cur in self.signal_date_list:
-                        if self.signal_list["signal"].loc[date_cur] ==0:
-                            cur_price = self.bars.get_latest_bar_value(s)
-                            dt = datetime.datetime.utcnow()
-
-                            weight = 0
-
-                            if not cur_price == 0:
-                                signal = SignalEvent(datetime=date_cur, symbol=s,
-                                                     timestamp=dt, order_price=cur_price, signal_type=None, weight=weight)
-                                self.events.put(signal)
-                        else:
-                            # print(date_cur)
-                            trading_days = self.order_list[s].date.tolist()
-                            if date_cur in trading_days:
-                                print(date_cur)
-                                cur_price = self.bars.get_latest_bar_value(s)
-                                dt = datetime.datetime.utcnow()
-                                index = trading_days.index(date_cur)
-                                weight = self.order_list[s].iloc[index, 2]
-                                signal = SignalEvent(datetime=date_cur, symbol=s,
-                                                     timestamp=dt, order_price=cur_price, signal_type=None,
-                                                     weight=weight)
-                                self.events.put(signal)
-                            else:
-                                self.reading_orders = False
-                    else:
-                        #print(date_cur)
-                        trading_days = self.order_list[s].date.tolist()
-                        if date_cur in trading_days:
-                            print(date_cur)
-                            cur_price = self.bars.get_latest_bar_value(s)
-                            dt = datetime.datetime.utcnow()
-                            index = trading_days.index(date_cur)
-                            weight = self.order_list[s].iloc[index, 2]
-                            signal = SignalEvent(datetime=date_cur, symbol=s,
-                                                 timestamp=dt, order_price=cur_price, signal_type=None, weight=weight)
-                            self.events.put(signal)
-                        else:
-                            self.reading_orders = False
+                date_cur = self.bars.get_latest_bar_ordinal()
+                prices = self.bars.get_latest_cross_section("close")
+
+                if self.rms_signals.get(date_cur) == 0:
+                    # Clear every position that can be priced
+                    indices = np.flatnonzero(prices != 0)
+                    weights = np.zeros(len(indices))
+                elif date_cur in self.rebalance_index:
+                    print(self.bars.get_latest_bar_datetime(self.symbol_list[0]))
+                    indices, weights = self.rebalance_index[date_cur]
+                else:
+                    indices = weights = ()
+
+                dt = datetime.datetime.utcnow()
+                if self.batch_signals:
+                    if len(indices):
+                        self.events.put(TargetWeightEvent(date_cur, dt, indices, weights, prices[indices]))
+                else:
+                    for i, weight in zip(indices, weights):
+                        signal = SignalEvent(datetime=date_cur, symbol_id=i,
+                                             timestamp=dt, order_price=prices[i], signal_type=None, weight=weight)
+                        self.events.put(signal)
 
                 self.reading_orders = True
 
             else:
                 self.reading_orders = False
-
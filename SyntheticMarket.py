@@ -0,0 +1,67 @@
+# SyntheticMarket.py
+# This file generates synthetic price data, order lists and RMS signals in the shapes main.py loads.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def make_market(n_symbols, n_bars, rebalance_every, n_holdings=None, first_date="2014-10-01", seed=0):
+    """
+    Return (stock_data, order_data, signal_data):
+    stock_data has one OHLCV row per symbol and bar, with some symbols listing late or missing bars;
+    order_data maps every symbol to its equal-weight orders, one rebalance every rebalance_every bars;
+    signal_data is indexed by Date with one RMS clear signal (0) and one hold signal (1).
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(first_date, periods=n_bars).strftime("%Y-%m-%d").values
+    symbols = np.array(["%06d.XSHE" % (i + 1) for i in range(n_symbols)], dtype=object)
+    if n_holdings is None:
+        n_holdings = max(1, n_symbols // 5)
+
+    close = 10 * np.exp(np.cumsum(rng.normal(0.0002, 0.02, (n_symbols, n_bars)), axis=1))
+    listed = np.ones((n_symbols, n_bars), dtype=bool)
+    listed[::7, :n_bars // 10] = False  # Late listings
+    listed[3::11, n_bars // 2:n_bars // 2 + 5] = False  # Suspensions
+
+    rows, cols = np.nonzero(listed)
+    px = close[rows, cols]
+    stock_data = pd.DataFrame({
+        'datetime': dates[cols], 'symbol': symbols[rows],
+        'open': px * (1 + rng.normal(0, 0.005, len(px))), 'high': px * 1.01, 'low': px * 0.99,
+        'close': px, 'volume': rng.integers(1000, 100000, len(px)).astype(float),
+    }).sort_values(['datetime', 'symbol']).reset_index(drop=True)
+
+    # Only names that have listed by the rebalance date are picked
+    rebalance_bars = np.arange(0, n_bars, rebalance_every)
+    ever_listed = np.maximum.accumulate(listed, axis=1)
+    rebalance_dates = dates[rebalance_bars]
+    orders = pd.DataFrame({
+        'date': np.repeat(rebalance_dates, n_holdings),
+        'stock': np.concatenate([rng.choice(symbols[ever_listed[:, t]], n_holdings, replace=False)
+                                 for t in rebalance_bars]),
+        'weight': 1.0 / n_holdings,
+    })
+    order_data = dict((s, orders[orders.stock == s].reset_index(drop=True)) for s in symbols)
+
+    signal_dates = [dates[int(n_bars * 0.6)], rebalance_dates[len(rebalance_dates) // 3]]
+    signal_data = pd.DataFrame({'Date': signal_dates, 'signal': [0, 1]}).set_index('Date')
+
+    return stock_data, order_data, signal_data
+
+
+def write_index_files(dates, path, seed=0):
+    """
+    Write two synthetic index price files covering dates, one in the 000800.csv layout
+    ("%Y-%m-%d") and one in the SPX.csv layout ("%Y/%m/%d"). Returns their paths.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.to_datetime(pd.Series(dates))
+    csi_path = os.path.join(path, 'index_csi.csv')
+    spx_path = os.path.join(path, 'index_spx.csv')
+    pd.DataFrame({'date': dates.dt.strftime("%Y-%m-%d"),
+                  'close': 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))}).to_csv(csi_path, index=False)
+    pd.DataFrame({'date': dates.dt.strftime("%Y/%m/%d"),
+                  'close': 2000 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))}).to_csv(spx_path, index=False)
+    return csi_path, spx_path
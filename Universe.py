@@ -0,0 +1,49 @@
+# Universe.py
+# This file interns symbols to dense integer ids and dates to int64 day ordinals, so events, positions
+# and lookups work on integers and strings are only restored for reporting.
+
+import numpy as np
+
+
+def date_ordinal(date):
+    """
+    Days since 1970-01-01 of a "%Y-%m-%d" string, datetime or numpy datetime64.
+    """
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+def date_ordinals(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def date_strings(ordinals):
+    """
+    "%Y-%m-%d" strings of day ordinals, as an object array.
+    """
+    return np.datetime_as_string(np.asarray(ordinals, dtype=np.int64).astype('datetime64[D]')).astype(object)
+
+
+class Universe(object):
+    """
+    The symbols of a backtest in symbol_list order; a symbol's id is its position in the list.
+    """
+
+    def __init__(self, symbol_list):
+        self.symbols = np.asarray(symbol_list, dtype=object)
+        self.ids = dict((s, i) for i, s in enumerate(self.symbols))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def symbol_id(self, symbol):
+        try:
+            return self.ids[symbol]
+        except KeyError:
+            print("That symbol is not available in the universe.")
+            raise
+
+    def symbol_ids(self, symbols):
+        return np.array([self.symbol_id(s) for s in symbols], dtype=np.int64)
+
+    def symbol(self, symbol_id):
+        return self.symbols[symbol_id]
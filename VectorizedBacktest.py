@@ -0,0 +1,145 @@
+# VectorizedBacktest.py
+# This file runs target-weight strategies as matrix operations over the date x symbol grid
+# instead of going event by event, and checks the result against the event loop.
+
+import numpy as np
+
+from Portfolio import RebalanceSizer
+
+
+class VectorizedBacktest(object):
+    """
+    Whole-run equivalent of the event loop for a Smartbeta-style strategy (dated target weights
+    and RMS clear signals) sized by WeightstoPosition and filled by SimulatedExecutionHandler.
+    Only rebalance bars are visited one by one; the bars in between are marked to market in blocks.
+    Results are written into the same portfolio history and execution journal as the event loop.
+    """
+
+    def __init__(self, data_handler, strategy, portfolio, execution_handler):
+        self.data_handler = data_handler
+        self.strategy = strategy
+        self.portfolio = portfolio
+        self.execution_handler = execution_handler
+
+    def _bar_matrix(self):
+        """
+        Close prices (time x symbol), datetimes and day ordinals of the bars the handler would feed.
+        """
+        bars = self.data_handler
+        if hasattr(bars, 'bar_data'):
+            start = bars.start_index
+            return bars.bar_data['close'][:, start:].T, bars.dates[start:], bars.date_ordinals[start:]
+        return bars.get_value_matrix('close'), bars.dates, bars.date_ordinals
+
+    def _targets(self, date, prices):
+        """
+        Symbol ids and target weights the strategy emits on the date with day ordinal date, or None.
+        """
+        if self.strategy.rms_signals.get(date) == 0:
+            indices = np.flatnonzero(prices != 0)
+            return indices, np.zeros(len(indices))
+        return self.strategy.rebalance_index.get(date)
+
+    def run(self):
+        """
+        Run the backtest and return the number of events the event loop would have handled, per type.
+        """
+        close, dates, ordinals = self._bar_matrix()
+        if len(dates) == 0:
+            return {}
+        # The event loop marks the last bar twice: once when fed and once when the data runs out
+        steps = np.append(np.arange(len(dates)), len(dates) - 1)
+
+        portfolio = self.portfolio
+        journal = self.execution_handler.journal
+        equity = portfolio.current_holdings['total']
+        sizer = RebalanceSizer(portfolio.commission, portfolio.cash_feasible)
+        fill_commission = self.execution_handler.commission
+        counts = {'MARKET': 2 * len(steps), 'SIGNAL': 0, 'ORDER': 0, 'FILL': 0}
+
+        first = 0
+        for k, t in enumerate(steps):
+            targets = self._targets(int(ordinals[t]), close[t])
+            if targets is None:
+                continue
+            portfolio.update_timeindex_block(dates[steps[first:k + 1]], close[steps[first:k + 1]])
+            first = k + 1
+
+            indices, weights = targets
+            prices = close[t, indices]
+            delta = sizer.size(equity, weights, prices, portfolio.current_positions.values[indices],
+                               cash=portfolio.current_holdings['cash'])
+            traded = delta != 0
+            indices, delta, prices = indices[traded], delta[traded], prices[traded]
+
+            journal.extend(ordinals[t], indices, np.where(delta > 0, 'LONG', 'EXIT'), np.abs(delta), prices)
+            portfolio.apply_fills(indices, delta, prices, fill_commission)
+            counts['SIGNAL'] += len(traded)
+            counts['ORDER'] += len(delta)
+            counts['FILL'] += len(delta)
+
+        portfolio.update_timeindex_block(dates[steps[first:]], close[steps[first:]])
+        self.strategy.reading_orders = True
+        self.data_handler.continue_backtest = False
+        return counts
+
+
+def check_parity(stock_data, symbol_list, order_list, signal_list, initial_capital, start_date, rtol=1e-9):
+    """
+    Run the same configuration through the event loop and the vectorized engine and diff
+    holdings, positions, execution records and event counts. Returns a dict of differences
+    with a 'match' flag.
+    """
+    from BacktestController import Backtest
+    from DataHandler import ColumnarDataHandler
+    from EventBuilder import EventBus
+    from Execution import SimulatedExecutionHandler
+    from Portfolio import WeightstoPosition
+    from StrategyFactory import Smartbeta
+
+    runs = {}
+    for engine in ('event', 'vectorized'):
+        backtest = Backtest(stock_data=stock_data, symbol_list=symbol_list, order_list=order_list,
+                            signal_list=signal_list, initial_capital=initial_capital, heartbeat=0.0,
+                            start_date=start_date, data_handler_cls=ColumnarDataHandler,
+                            execution_handler_cls=SimulatedExecutionHandler, portfolio_cls=WeightstoPosition,
+                            strategy_cls=Smartbeta, event_queue_cls=EventBus, engine=engine)
+        backtest.run_engine()
+        runs[engine] = backtest
+
+    event, vectorized = runs['event'], runs['vectorized']
+    report = dict()
+    holdings = [b.portfolio.holdings_frame() for b in (event, vectorized)]
+    positions = [b.portfolio.positions_frame() for b in (event, vectorized)]
+    records = [b.execution_handler.execution_records for b in (event, vectorized)]
+
+    report['rows'] = (len(holdings[0]), len(holdings[1]))
+    report['datetime_match'] = bool((holdings[0].datetime.values == holdings[1].datetime.values).all()) \
+        if report['rows'][0] == report['rows'][1] else False
+    if report['datetime_match']:
+        values = [h.drop(columns='datetime').values.astype(float) for h in holdings]
+        report['holdings_max_abs_diff'] = float(np.abs(values[0] - values[1]).max())
+        report['holdings_match'] = bool(np.allclose(values[0], values[1], rtol=rtol, atol=0))
+        report['positions_match'] = positions[0].equals(positions[1])
+    report['executions'] = (len(records[0]), len(records[1]))
+    report['executions_match'] = report['executions'][0] == report['executions'][1] and \
+        records[0].drop(columns='order_price').equals(records[1].drop(columns='order_price')) and \
+        bool(np.allclose(records[0].order_price.values, records[1].order_price.values, rtol=rtol, atol=0))
+    report['event_counts'] = (dict(event.event_counts), dict(vectorized.event_counts))
+    counts_match = all(event.event_counts[k] == vectorized.event_counts[k] for k in ('SIGNAL', 'ORDER', 'FILL'))
+
+    report['match'] = bool(report['datetime_match'] and report['holdings_match'] and report['positions_match']
+                           and report['executions_match'] and counts_match)
+    return report
+
+
+if __name__ == "__main__":
+    import datetime
+    import pprint
+
+    from SyntheticMarket import make_market
+
+    stock_data, order_data, signal_data = make_market(n_symbols=50, n_bars=300, rebalance_every=21, seed=1)
+    report = check_parity(stock_data, stock_data.symbol.unique(), order_data, signal_data,
+                          initial_capital=100000000.0, start_date=datetime.datetime(2015, 1, 1))
+    pprint.pprint(report)
@@ -2,10 +2,10 @@ import datetime
 import time
 import pandas as pd
 
-from EventBuilder import OrderEvent
-from DataHandler import HistoricDataHandler
+from EventBuilder import OrderEvent, EventBus
+from DataHandler import MemmapDataHandler, open_bar_store, refresh_bar_store
 
-from StrategyFactory import Smartbeta
+from StrategyFactory import Smartbeta, load_order_list
 
 from Execution import SimulatedExecutionHandler
 
@@ -16,41 +16,26 @@ from BacktestController import Backtest
 
 if __name__ == "__main__":
     start_time = time.process_time()
-    # input price data and feed into data Handler
-    stock_data = pd.read_pickle('post_adjusted_price.pkl')
+    # input price data and feed into data Handler. The pickle is converted into a memory-mapped
+    # bar store, rebuilt whenever the pickle is newer than the store.
+    refresh_bar_store('post_adjusted_price.pkl', 'bar_store')
+    stocks, _, _ = open_bar_store('bar_store')
     orders = pd.read_csv('all_orders_50.csv').iloc[:,-3:]
     signals = pd.read_csv('signal.csv')
     signal_data = signals.set_index("Date")
 
-    for i in range(0, len(orders)):
-        stock_symbol = orders.stock.iloc[i]
-        tail = stock_symbol[-2:]
-        # date_time = datetime.datetime.strptime(str(orders.date[i]), "%Y%m%d")
-        # orders.iloc[i, 0] = datetime.datetime.strftime(date_time, "%Y-%m-%d")
-        # spx[i, 0] =  datetime.datetime.strftime(date_time,"%Y-%m-%d")
-        if tail == "SZ":
-            orders.iloc[i, 1] = stock_symbol.replace('SZ', 'XSHE')
-        elif tail == "SH":
-            orders.iloc[i, 1] = stock_symbol.replace('SH', 'XSHG')
-
-    stocks = stock_data.symbol.unique()
-
-    order_data = {}
-    for s in stocks:
-        orderlist = orders[orders.stock.isin([s])]
-        # print(orderlist)
-        order_data[s] = orderlist.set_index('date').sort_index().reset_index()
+    order_data = load_order_list(orders, stocks)
 
     initial_capital = 100000000.0
     heartbeat = 0.0
     start_date = datetime.datetime(2015, 1, 1, 0, 0, 0)
 
-    backtest = Backtest(stock_data=stock_data, symbol_list=stocks, order_list=order_data,signal_list = signal_data,
+    backtest = Backtest(stock_data='bar_store', symbol_list=stocks, order_list=order_data,signal_list = signal_data,
                         initial_capital=initial_capital,
                         heartbeat=heartbeat, start_date=start_date,
-                        data_handler_cls=HistoricDataHandler, execution_handler_cls=SimulatedExecutionHandler,
+                        data_handler_cls=MemmapDataHandler, execution_handler_cls=SimulatedExecutionHandler,
                         portfolio_cls=WeightstoPosition,
-                        strategy_cls=Smartbeta)
+                        strategy_cls=Smartbeta, event_queue_cls=EventBus)
     backtest.run_trading()
 
     end_time = time.process_time()
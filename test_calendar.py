@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+from Calendar import RebalanceCalendar
+
+
+def boundary_dates(dates, frequency):
+    calendar = RebalanceCalendar(dates, frequency)
+    return list(np.asarray(dates)[calendar.boundaries])
+
+
+def test_weekly_boundaries_across_new_year():
+    dates = pd.bdate_range('2019-12-20', '2020-01-10').strftime("%Y-%m-%d").values
+    assert boundary_dates(dates, 'W') == ['2019-12-20', '2019-12-27', '2020-01-03', '2020-01-10']
+
+
+def test_monthly_boundaries_keep_last_bar():
+    dates = pd.bdate_range('2019-12-20', '2020-01-10').strftime("%Y-%m-%d").values
+    assert boundary_dates(dates, 'M') == ['2019-12-31', '2020-01-10']
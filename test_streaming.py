@@ -0,0 +1,40 @@
+import datetime
+import queue
+
+import pandas as pd
+
+from DataHandler import StreamingDataHandler
+
+
+def make_rows():
+    dates = pd.to_datetime(['2015-01-05', '2015-01-05', '2015-01-06', '2015-01-06', '2015-01-07'])
+    return pd.DataFrame({'datetime': dates, 'symbol': ['A', 'B', 'A', 'B', 'A'],
+                         'close': [1.0, 2.0, 1.5, 2.5, 1.2], 'volume': [10, 20, 30, 40, 50]})
+
+
+def stream(handler):
+    bars = []
+    while True:
+        handler.update_bars()
+        if not handler.continue_backtest:
+            return bars
+        bars.append((handler.get_latest_bar_datetime('A'), list(handler.get_latest_cross_section('close'))))
+
+
+def test_datetime_typed_and_empty_chunks(tmp_path):
+    rows = make_rows()
+    handler = StreamingDataHandler(queue.Queue(), str(tmp_path), datetime.datetime(2015, 1, 6), ['A', 'B'])
+    handler._read_chunks = lambda: iter([rows.iloc[:0], rows.iloc[:3], rows.iloc[:0], rows.iloc[3:]])
+    handler._stream = handler._iter_aligned_bars()
+
+    assert stream(handler) == [('2015-01-06', [1.5, 2.5]), ('2015-01-07', [1.2, 2.5])]
+
+
+def test_csv_partitions_match_datetime_typed_rows(tmp_path):
+    rows = make_rows()
+    rows.iloc[:2].to_csv(tmp_path / '2015-01-05.csv', index=False)
+    rows.iloc[:0].to_csv(tmp_path / '2015-01-06.csv', index=False)
+    rows.iloc[2:].to_csv(tmp_path / '2015-01-07.csv', index=False)
+    handler = StreamingDataHandler(queue.Queue(), str(tmp_path), datetime.datetime(2015, 1, 1), ['A', 'B'])
+
+    assert stream(handler) == [('2015-01-05', [1.0, 2.0]), ('2015-01-06', [1.5, 2.5]), ('2015-01-07', [1.2, 2.5])]
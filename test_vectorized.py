@@ -0,0 +1,12 @@
+import datetime
+
+from SyntheticMarket import make_market
+from VectorizedBacktest import check_parity
+
+
+def test_vectorized_engine_matches_event_loop():
+    stock_data, order_data, signal_data = make_market(n_symbols=20, n_bars=120, rebalance_every=10, seed=2)
+    report = check_parity(stock_data, stock_data.symbol.unique(), order_data, signal_data,
+                          initial_capital=100000000.0, start_date=datetime.datetime(2015, 1, 1))
+    assert report['executions'][0] > 0
+    assert report['match'], report